@@ -0,0 +1,46 @@
+from tinychat.network import available_codecs, decode_packet
+
+from argparse import ArgumentParser
+import time
+
+packets = {
+    "message": {'type': 'message', 'text': "+green(hello) everyone, how is it going?", 'user': "alice",
+                'channel': "__global__"},
+    "server_message": {'type': 'server_message', 'text': "+black(bobby) +green(joined)", 'channel': "__global__"},
+    "channel_set": {'type': 'channel_set', 'channel': "room"},
+    "authresp": {'type': 'authresp', 'success': True, 'username': "alice", 'codec': "binary",
+                 'compression': "deflate"},
+    "history": {'type': 'history', 'channel': "__global__", 'first': 1200,
+                'messages': [{'type': 'message', 'text': f"message number {n}", 'user': "bobby",
+                              'channel': "__global__"} for n in range(50)]}
+}
+
+
+def measure(func, arg, runs):  # -> microseconds per call
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(arg)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    parser = ArgumentParser(description="Encode and decode cost and size of the packet codecs")
+    parser.add_argument("--runs", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, packet in packets.items():
+        runs = args.runs // 50 if name == "history" else args.runs
+        print(f"{name}:")
+
+        for codec_name, codec in available_codecs.items():
+            data = codec.encode(packet)
+            if decode_packet(data) != packet:
+                raise AssertionError(f"{codec_name} does not round trip {name}")
+
+            encode = measure(codec.encode, packet, runs)
+            decode = measure(decode_packet, data, runs)
+            print(f"  {codec_name:<7} encode {encode:>7.2f} us   decode {decode:>7.2f} us   {len(data):>5} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+from tinychat.gui.colors import colors, convert_indexes, parse, parse2, _parse, _parse2
+
+from argparse import ArgumentParser
+import random
+import time
+
+
+def nested(length, depth):  # colors nested depth deep, repeated up to length characters, with some lines
+    names = list(colors)
+    parts = list()
+    size = 0
+
+    while size < length:
+        group = [f"+{random.choice(names)}(word{n} " for n in range(depth)]
+        group.append("text" + ")" * depth + (" plain\n" if random.random() < 0.1 else " plain "))
+        group = ''.join(group)
+        parts.append(group)
+        size += len(group)
+
+    return ''.join(parts)
+
+
+def measure(func, texts):  # -> seconds per call
+    start = time.perf_counter()
+    for text in texts:
+        func(text)
+    return (time.perf_counter() - start) / len(texts)
+
+
+def main():
+    parser = ArgumentParser(description="Markup parsing time by message length, nesting and recurring strings")
+    parser.add_argument("--lengths", type=int, nargs="*", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--depth", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=2000000, help="characters parsed per case")
+    args = parser.parse_args()
+
+    for length in args.lengths:
+        texts = [nested(length, args.depth) for _ in range(max(args.runs // length, 5))]
+        parsed = [_parse(text) for text in texts]
+
+        cases = {"parse": _parse, "parse2": _parse2}
+        results = [f"{name} {measure(func, texts) / length * 1e9:>6.0f} ns/char" for name, func in cases.items()]
+        results.append(f"convert_indexes {measure(convert_indexes, parsed) / length * 1e9:>6.0f} ns/char")
+
+        print(f"{length:>7} chars, {len(texts):>5} messages: " + "   ".join(results))
+
+    templates = [f"+green({name}) +black(joined the channel)" for name in ("alice", "bob", "carol")]
+    texts = [random.choice(templates) for _ in range(100000)]
+
+    for name, func in {"parse": parse, "parse2": parse2}.items():
+        uncached = measure({"parse": _parse, "parse2": _parse2}[name], texts)
+        cached = measure(func, texts)
+        print(f"recurring {name:<7} {uncached * 1e6:>6.2f} us uncached   {cached * 1e6:>6.2f} us cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from tinychat.network import (CompressionStats, FrameCompressor, FrameDecompressor, FrameDecoder, MAX_FRAME_SIZE,
+                              available_codecs, pack_frame, pack_fragments)
+
+from argparse import ArgumentParser
+import random
+import time
+
+words = ("hello everyone how is it going the build is green again did anyone see the new release lunch at noon "
+         "i pushed a fix for the login bug can you review it please thanks ok sure later tonight").split()
+users = ("alice", "bobby", "carol", "dave", "erin")
+channels = ("__global__", "room", "dev", "random")
+
+
+def chat_text():
+    text = ' '.join(random.choice(words) for _ in range(random.randint(2, 20)))
+    return f"+{random.choice(('green', 'red', 'yellow'))}({text})" if random.random() < 0.1 else text
+
+
+def workload(count, paste):  # -> the packets a client receives in a busy session
+    packets = list()
+
+    for n in range(count):
+        channel = random.choice(channels)
+
+        if n % 500 == 0:
+            packets.append({'type': 'history', 'channel': channel, 'first': n,
+                            'messages': [{'type': 'message', 'text': chat_text(), 'user': random.choice(users),
+                                          'channel': channel} for _ in range(50)]})
+        elif paste and n % 1000 == 1:
+            packets.append({'type': 'message', 'text': '\n'.join(chat_text() for _ in range(paste // 60)),
+                            'user': random.choice(users), 'channel': channel})
+        elif n % 20 == 0:
+            packets.append({'type': 'server_message', 'channel': channel,
+                            'text': f"+black({random.choice(users)}) +green(joined)"})
+        else:
+            packets.append({'type': 'message', 'text': chat_text(), 'user': random.choice(users), 'channel': channel})
+
+    return packets
+
+
+def send(messages, compress):  # -> the bytes on the wire, seconds, the compressor stats
+    stats = CompressionStats()
+    compressor = FrameCompressor(stats) if compress else None
+    frames = list()
+
+    start = time.process_time()
+    for data in messages:
+        if len(data) > MAX_FRAME_SIZE:
+            frames.extend(compressor.pack_fragments(data) if compressor else pack_fragments(data))
+        else:
+            frames.append(compressor.pack(data) if compressor else pack_frame(data))
+    elapsed = time.process_time() - start
+
+    return b''.join(frames), elapsed, stats
+
+
+def receive(stream, messages, compress, chunk):  # -> seconds, the decompressor stats
+    stats = CompressionStats()
+    decoder = FrameDecoder(decompressor=FrameDecompressor(stats) if compress else None)
+    received = list()
+
+    start = time.process_time()
+    for pos in range(0, len(stream), chunk):
+        received.extend(decoder.feed(stream[pos:pos + chunk]))
+    elapsed = time.process_time() - start
+
+    if received != messages:
+        raise AssertionError("the received messages differ")
+    return elapsed, stats
+
+
+def main():
+    parser = ArgumentParser(description="Bytes on the wire and cpu time of a chat session with and without deflate")
+    parser.add_argument("--packets", type=int, default=50000)
+    parser.add_argument("--paste", type=int, default=100 * 1024, help="size of an occasional long paste, 0 for none")
+    parser.add_argument("--chunk", type=int, default=16 * 1024, help="read size of the receiver")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    packets = workload(args.packets, args.paste)
+
+    for name, codec in available_codecs.items():
+        messages = [bytes(codec.encode(packet)) for packet in packets]
+        payload = sum(len(data) for data in messages)
+        print(f"{name}: {len(messages):,} packets, {payload / 2 ** 20:.2f} MB encoded")
+
+        for compress in (False, True):
+            stream, send_time, send_stats = send(messages, compress)
+            receive_time, receive_stats = receive(stream, messages, compress, args.chunk)
+
+            result = (f"  {'deflate' if compress else 'plain':<8} {len(stream) / 2 ** 20:>7.2f} MB on the wire "
+                      f"({len(stream) / payload:>5.1%})   send {send_time * 1e3:>7.1f} ms cpu   "
+                      f"receive {receive_time * 1e3:>7.1f} ms cpu")
+            if compress:
+                result += (f"   of it compress {send_stats.cpu_time * 1e3:.1f} ms, "
+                           f"decompress {receive_stats.cpu_time * 1e3:.1f} ms, "
+                           f"{send_stats.frames:,} of {len(messages):,} messages compressed")
+            print(result)
+
+
+if __name__ == "__main__":
+    main()
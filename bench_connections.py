@@ -0,0 +1,100 @@
+from tinychat.network import PORT, ServerSocket, pack_frame
+
+from argparse import ArgumentParser
+from multiprocessing import Pipe, Process
+from queue import Queue
+import resource
+import socket
+import time
+
+
+def raise_fd_limit(connections):  # -> connections allowed, the idle ends are kept by another process
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = connections + 64
+
+    if soft < wanted:
+        soft = min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    return soft - 64
+
+
+def hold_idle(addr, count, pipe):  # opens the idle connections and keeps them until told to stop
+    raise_fd_limit(count)
+    clients = [socket.create_connection(addr) for _ in range(count)]
+
+    pipe.send(len(clients))
+    pipe.recv()
+
+    for client in clients:
+        client.close()
+
+
+def wait_event(queue, etype):
+    while True:
+        event = queue.get()
+        if event[0] == etype:
+            return event
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run(port, idle, wakeups):  # -> p50 and p99 of the time from a send to the packet event, in microseconds
+    queue = Queue()
+    ssocket = ServerSocket(port, queue, print)
+    ssocket.open()
+    wait_event(queue, "server_start")
+
+    addr = ("127.0.0.1", port)
+
+    pipe, child_pipe = Pipe()
+    holder = Process(target=hold_idle, args=(addr, idle, child_pipe))
+    holder.start()
+
+    for _ in range(idle):
+        wait_event(queue, "connection_request")
+    pipe.recv()
+
+    active = socket.create_connection(addr)
+    active.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    wait_event(queue, "connection_request")
+
+    frame = pack_frame(b"wakeup")
+    samples = list()
+
+    for _ in range(wakeups):
+        sent = time.perf_counter()
+        active.sendall(frame)
+        wait_event(queue, "packet")
+        samples.append((time.perf_counter() - sent) * 1e6)
+
+    active.close()
+    pipe.send(None)
+    holder.join()
+    ssocket.close()
+
+    samples.sort()
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def main():
+    parser = ArgumentParser(description="Cost of a ServerSocket wakeup with many idle connections open")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--idle", type=int, nargs="*", default=[100, 1000, 10000])
+    parser.add_argument("--wakeups", type=int, default=2000)
+    args = parser.parse_args()
+
+    for i, idle in enumerate(args.idle):
+        allowed = raise_fd_limit(idle + 1) - 1
+        if allowed < idle:
+            print(f"{idle:>6} idle: skipped, the open file limit allows {allowed}")
+            continue
+
+        p50, p99 = run(args.port + i, idle, args.wakeups)
+        print(f"{idle:>6} idle: p50 {p50:>7.1f} us   p99 {p99:>7.1f} us   ({args.wakeups} wakeups)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from tinychat.network import FrameDecoder, MAX_FRAME_SIZE, pack_frame, pack_fragments
+
+from argparse import ArgumentParser
+import os
+import random
+import time
+
+
+def build_stream(messages, large):  # -> the bytes on the wire, the messages they carry
+    payloads = list()
+    frames = list()
+
+    for n in range(messages):
+        if n % 100 == 0 and large:  # a long paste, sent as fragments
+            data = os.urandom(random.randrange(MAX_FRAME_SIZE, large))
+            frames.extend(pack_fragments(data))
+        else:
+            data = os.urandom(random.randrange(1, 200))
+            frames.append(pack_frame(data))
+        payloads.append(data)
+
+    return b''.join(frames), payloads
+
+
+def split(stream, max_chunk):  # random read sizes, as TCP hands them over
+    chunks = list()
+    pos = 0
+
+    while pos < len(stream):
+        size = random.randint(1, max_chunk)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+
+    return chunks
+
+
+def run(chunks, payloads):  # -> seconds
+    decoder = FrameDecoder()
+    received = 0
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        for message in decoder.feed(chunk):
+            if message != payloads[received]:
+                raise AssertionError(f"message {received} differs")
+            received += 1
+    elapsed = time.perf_counter() - start
+
+    if received != len(payloads):
+        raise AssertionError(f"{received} of {len(payloads)} messages decoded")
+    return elapsed
+
+
+def main():
+    parser = ArgumentParser(description="FrameDecoder throughput over a stream split at random points")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--large", type=int, default=64 * 1024, help="size limit of the fragmented messages, 0 for none")
+    parser.add_argument("--chunks", type=int, nargs="*", default=[16, 1400, 16 * 1024, 64 * 1024],
+                        help="largest read size of each run, reads are 1 byte up to it")
+    args = parser.parse_args()
+
+    stream, payloads = build_stream(args.messages, args.large)
+    print(f"{len(payloads):,} messages, {len(stream) / 2 ** 20:.1f} MB")
+
+    for max_chunk in args.chunks:
+        chunks = split(stream, max_chunk)
+        elapsed = run(chunks, payloads)
+        print(f"reads up to {max_chunk:>6} B: {len(stream) / elapsed / 2 ** 20:>8.1f} MB/s   "
+              f"{len(payloads) / elapsed:>10,.0f} msg/s   ({len(chunks):,} reads)")
+
+
+if __name__ == "__main__":
+    main()
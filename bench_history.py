@@ -0,0 +1,79 @@
+from tinychat.network import binary_codec
+from tinychat.server.history_store import ChannelLog, HistoryStore, SEGMENT_MESSAGES, WRITE_BATCH, PAGE_SIZE
+
+from argparse import ArgumentParser
+import random
+import shutil
+import tempfile
+import time
+import os
+
+
+def bench_append(path, count, segment_messages):
+    log = ChannelLog(path, segment_messages=segment_messages, retention=count // segment_messages + 1)
+    datas = [binary_codec.encode({'type': 'message', 'text': f"message {n} " + "x" * (n % 80), 'user': "user",
+                                  'channel': "bench"}) for n in range(WRITE_BATCH)]
+
+    start = time.perf_counter()
+    for _ in range(count // WRITE_BATCH):
+        log.append(datas)
+    elapsed = time.perf_counter() - start
+
+    return log, log.next / elapsed
+
+
+def bench_store(path, count):  # encoding and writing by the writer thread, as the server does it
+    store = HistoryStore(path, print)
+    store.open()
+
+    start = time.perf_counter()
+    for n in range(count):
+        store.append("bench", {'type': 'message', 'text': f"message {n}", 'user': "user", 'channel': "bench"})
+    queued = time.perf_counter() - start
+
+    store.close()
+    return count / queued, count / (time.perf_counter() - start)
+
+
+def bench_pages(log, pages, limit):
+    latencies = list()
+
+    for _ in range(pages):
+        before = random.randrange(log.first + limit, log.next)
+
+        start = time.perf_counter()
+        log.read(before=before, limit=limit)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = ArgumentParser(description="Append throughput and page fetch latency of the history store")
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--segment-messages", type=int, default=SEGMENT_MESSAGES)
+    parser.add_argument("--store-messages", type=int, default=100_000)
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=PAGE_SIZE)
+    parser.add_argument("--dir", help="directory for the logs, a temporary one by default")
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(dir=args.dir)
+
+    try:
+        log, rate = bench_append(os.path.join(path, "log"), args.messages, args.segment_messages)
+        print(f"log append:    {rate:>12,.0f} msg/s   ({log.next:,} messages, {len(log.segments)} segments)")
+
+        p50, p99 = bench_pages(log, args.pages, args.limit)
+        print(f"page fetch:    p50 {p50 * 1e6:.1f} us   p99 {p99 * 1e6:.1f} us   ({args.limit} messages per page)")
+        log.close()
+
+        queued, written = bench_store(os.path.join(path, "store"), args.store_messages)
+        print(f"store append:  {queued:>12,.0f} msg/s queued by the event thread, {written:,.0f} msg/s written")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+from argparse import ArgumentParser
+import statistics
+import subprocess
+import sys
+import time
+
+modules = ("tinychat.network", "tinychat.server", "tinychat.client")
+deferred = ("tkinter", "netifaces", "asyncio", "sqlite3")  # must not be imported by the modules above
+
+
+def cold_start(code, runs):
+    times = list()
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def main():
+    parser = ArgumentParser(description="Cold start time of the tinychat packages, over a bare interpreter")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=100, help="milliseconds per package, exit status 1 above it")
+    args = parser.parse_args()
+
+    bare = cold_start("pass", args.runs)
+    failed = False
+
+    for module in modules:
+        elapsed = (cold_start(f"import {module}", args.runs) - bare) * 1000
+
+        check = f"import sys, {module}; print(' '.join(m for m in {deferred!r} if m in sys.modules))"
+        loaded = subprocess.run([sys.executable, "-c", check], check=True, capture_output=True, text=True).stdout.split()
+
+        over = elapsed > args.budget
+        failed |= over or bool(loaded)
+
+        print(f"{module:<18} {elapsed:>7.1f} ms{'  over budget' if over else ''}"
+              f"{'  imports ' + ', '.join(loaded) if loaded else ''}")
+
+    # the server entry point, parsing its arguments only
+    check = ("import contextlib, io, runpy, sys; sys.argv = ['server_main.py', '--help']\n"
+             "with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n"
+             "    runpy.run_path('server_main.py', run_name='__main__')\n"
+             f"print(' '.join(m for m in {deferred!r} if m in sys.modules))")
+    loaded = subprocess.run([sys.executable, "-c", check], check=True, capture_output=True, text=True).stdout.split()
+    failed |= bool(loaded)
+
+    print(f"{'server_main --help':<18}{'  imports ' + ', '.join(loaded) if loaded else '  ok'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from tinychat.network import PORT, ServerSocket, AsyncServerSocket, FrameDecoder, pack_frame, binary_codec, decode_packet
+from tinychat.server import Server, NullUi
+
+from argparse import ArgumentParser
+from queue import Queue
+from threading import Thread
+import socket
+import time
+
+
+def start_server(runtime, port):
+    queue = Queue()
+
+    if runtime == "asyncio":
+        ssocket = AsyncServerSocket(port, None, print)
+        server = Server(ssocket, queue)
+        ssocket.handler = server.dispatch
+    else:
+        ssocket = ServerSocket(port, queue, print)
+        server = Server(ssocket, queue)
+
+    server.ui = NullUi()
+    ssocket.open()
+
+    if runtime != "asyncio":
+        Thread(target=server.event_proc, daemon=True).start()
+
+    return ssocket, server
+
+
+class BenchClient:
+    def __init__(self, n, addr):
+        # users are told apart by ip, so each client gets its own loopback address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.bind((f"127.0.0.{n + 1}", 0))
+        self.sock.connect(addr)
+
+        self.decoder = FrameDecoder()
+        self.pending = list()
+
+        self.send({'type': 'login', 'username': f"bench{n}", 'codecs': ['binary']})
+        self.wait('authresp')
+
+    def send(self, packet):
+        self.sock.sendall(pack_frame(binary_codec.encode(packet)))
+
+    def wait(self, ptype, text=None):
+        while True:
+            for packet in self.pending:
+                if packet['type'] == ptype and (text is None or packet.get('text') == text):
+                    self.pending.clear()
+                    return time.perf_counter()
+
+            self.pending.clear()
+            n = self.decoder.recv_into(self.sock)
+            if not n:
+                raise ConnectionError("server closed the connection")
+            self.pending.extend(decode_packet(pdata) for pdata in self.decoder.frames())
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run(runtime, port, clients, messages):
+    ssocket, server = start_server(runtime, port)
+    addr = ssocket.addr
+
+    sender, *receivers = [BenchClient(n, addr) for n in range(clients)]
+    time.sleep(0.2)
+
+    for client in receivers:  # join notifications of later clients
+        client.pending.clear()
+
+    samples = list()
+    results = [0] * len(receivers)
+
+    for i in range(messages):
+        text = f"bench {i}"
+
+        def receive(k):
+            results[k] = receivers[k].wait('message', text)
+
+        threads = [Thread(target=receive, args=(k,)) for k in range(len(receivers))]
+        for thread in threads:
+            thread.start()
+
+        sent = time.perf_counter()
+        sender.send({'type': 'message', 'text': text, 'channel': '__global__'})
+
+        for thread in threads:
+            thread.join()
+
+        samples.extend((received - sent) * 1000 for received in results)
+
+    for client in [sender] + receivers:
+        client.sock.close()
+    ssocket.close()
+
+    samples.sort()
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def main():
+    parser = ArgumentParser(description="Message latency of the server runtimes")
+    parser.add_argument("--runtime", choices=("threaded", "asyncio", "both"), default="both")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    runtimes = ("threaded", "asyncio") if args.runtime == "both" else (args.runtime,)
+
+    for i, runtime in enumerate(runtimes):
+        p50, p99 = run(runtime, args.port + i, args.clients, args.messages)
+        print(f"{runtime:>8}: p50 {p50:.3f} ms, p99 {p99:.3f} ms "
+              f"({args.clients - 1} receivers, {args.messages} messages)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+from tinychat.server.user import User, UserList, ConnectionList
+
+from argparse import ArgumentParser
+import random
+import timeit
+
+
+def build(count):
+    userlist = UserList()
+    uconnections = ConnectionList(userlist)
+
+    for n in range(count):
+        addr = (f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}", 40000 + n % 20000)
+
+        user = User(addr)
+        user.set_username(f"user{n}", f"user{n}")
+        userlist.add_user(user)
+
+        uconnections.create_temp_connection(object(), addr)
+        uconnections.create_connection(object(), addr)
+
+    return userlist, uconnections
+
+
+def main():
+    parser = ArgumentParser(description="Lookup cost of the user and connection registries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'find_by_addr':>14} {'find_by_name':>14} {'conn by addr':>14} {'conn by uname':>14} {'rename':>10}")
+
+    for count in args.sizes:
+        userlist, uconnections = build(count)
+
+        users = list(userlist)
+        sample = [random.choice(users) for _ in range(args.lookups)]
+        conns = {conn.user: conn for conn in uconnections}
+
+        def per_op(func):
+            return timeit.timeit(func, number=1) / args.lookups * 1e9
+
+        results = (
+            per_op(lambda: [userlist.find_by_addr((user.addr,)) for user in sample]),
+            per_op(lambda: [userlist.find_by_name(user.username_p) for user in sample]),
+            per_op(lambda: [uconnections.find_by_addr(conns[user].addr) for user in sample]),
+            per_op(lambda: [uconnections.find_by_uname(user.username_p) for user in sample]),
+            per_op(lambda: [user.set_username(user.username, user.username_p) for user in sample])
+        )
+
+        print(f"{count:>8} " + ' '.join(f"{ns:>11.0f} ns" for ns in results[:4]) + f" {results[4]:>7.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+from tinychat.network import ServerSocket
+from tinychat.server import Server
+from tinychat.server.channel import Channel, channel_user, PERM_WRITE
+from tinychat.server.user import User, UserTag, uconn_t
+
+from argparse import ArgumentParser
+from queue import Queue
+import timeit
+
+
+def build(tags, rights):
+    server = Server(ServerSocket(0, Queue(), print), Queue())
+
+    user = User(("10.0.0.1", 40000))
+    user.set_username("user", "user")
+    for n in range(tags):
+        user.add_tag(UserTag(f"tag{n}", 10 + n, {f"right{n}.{m}": m & 1 for m in range(rights)}))
+
+    channel = Channel(server, "bench", "Server")
+    channel.write_right = f"right{rights - 1}"
+
+    c_user = channel_user(uconn_t(None, None, user), user, [channel.name], {channel.name: set()})
+    c_user.channel_rights[channel.name].update(f"right{m}" for m in range(rights))
+    channel.users[user] = c_user
+
+    return user, channel, c_user
+
+
+def main():
+    parser = ArgumentParser(description="Per-message admission cost with many tags and channel rights")
+    parser.add_argument("--tags", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--rights", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'tags':>6} {'rights':>7} {'recomputed':>12} {'cached':>12}")
+
+    for tags in args.tags:
+        user, channel, c_user = build(tags, args.rights)
+
+        def admit():
+            return user.check_right("sendMessagesAllowed", 1) and channel.get_permissions(c_user) & PERM_WRITE
+
+        def admit_uncached():  # cache dropped before every message
+            user._effective = None
+            channel.permissions.clear()
+            return admit()
+
+        def per_op(func):
+            return timeit.timeit(func, number=args.messages) / args.messages * 1e9
+
+        uncached, cached = per_op(admit_uncached), per_op(admit)
+        print(f"{tags:>6} {args.rights:>7} {uncached:>9.0f} ns {cached:>9.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from tinychat.server.search import SearchIndex
+
+from argparse import ArgumentParser
+import itertools
+import random
+import time
+
+
+def build(count, vocabulary):
+    words = [f"word{n}" for n in range(vocabulary)]
+    weights = list(itertools.accumulate(1 / (n + 1) for n in range(vocabulary)))  # zipf-like, as in real chat
+    index = SearchIndex(count, 2 ** 62)  # every message kept, as with a history that large
+
+    start = time.perf_counter()
+    for n in range(count):
+        text = ' '.join(random.choices(words, cum_weights=weights, k=8))
+        if n % 10 == 0:
+            text = f"+green({text})"
+        index.add(f"user{n % 1000}", text)
+
+    return index, count / (time.perf_counter() - start)
+
+
+def measure(index, queries):
+    latencies = list()
+
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = ArgumentParser(description="Indexing rate and query latency of the channel search index")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    index, rate = build(args.messages, args.vocabulary)
+    print(f"indexed {len(index):,} messages at {rate:,.0f} msg/s, {len(index.postings):,} words")
+
+    vocabulary = args.vocabulary
+    cases = {
+        "common word": lambda: f"word{random.randrange(10)}",
+        "rare word": lambda: f"word{random.randrange(vocabulary // 2, vocabulary)}",
+        "two common words": lambda: f"word{random.randrange(10)} word{random.randrange(10, 100)}",
+        "common and rare": lambda: f"word{random.randrange(10)} word{random.randrange(vocabulary // 2, vocabulary)}",
+        "missing word": lambda: "nosuchword"
+    }
+
+    for name, query in cases.items():
+        p50, p99 = measure(index, [query() for _ in range(args.queries)])
+        print(f"{name:<18} p50 {p50 * 1e6:>9.1f} us   p99 {p99 * 1e6:>9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from tinychat.network import PORT, ServerSocket, FrameDecoder, pack_frame, binary_codec, decode_packet
+from tinychat.server import Server, ShardBus, NullUi, LogUi, start_logging
+
+from argparse import ArgumentParser
+from queue import Queue
+from threading import Thread, Event
+import logging
+import os
+import selectors
+import signal
+import socket
+import time
+
+
+def run_worker(port, shard, shards, ui):
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    queue = Queue()
+    ssocket = ServerSocket(port, queue, print, reuse_port=shards > 1)
+    bus = ShardBus(port, shard, shards, print) if shards > 1 else None
+
+    server = Server(ssocket, queue, bus)
+    server.ui = NullUi()
+
+    if ui == "log":
+        start_logging(logging.FileHandler(os.devnull))
+        server.ui = LogUi()
+
+    ssocket.open()
+    Thread(target=server.event_proc, daemon=True).start()
+    if bus:
+        bus.open()
+
+    if ui == "gui":  # every message of __global__ is rendered, as by server_main.py without --headless
+        from tinychat.gui import AppGui
+        from tkinter import Tk
+
+        root = Tk()
+        server.ui = AppGui(root, server.userinput, root.quit)
+
+        def poll():
+            if stop.is_set():
+                root.quit()
+            else:
+                root.after(100, poll)
+
+        poll()
+        root.mainloop()
+    else:
+        stop.wait()
+
+    ssocket.close()
+    if bus:
+        bus.close()
+
+
+def run_load(port, first, count, duration, result_w):
+    # every connection sends to __global__ as fast as the server takes it and counts what it receives
+    selector = selectors.DefaultSelector()
+    decoders = dict()
+
+    for n in range(first, first + count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((f"127.0.{n // 250}.{n % 250 + 1}", 0))  # users are told apart by ip
+        sock.connect(("127.0.0.1", port))
+        sock.sendall(pack_frame(binary_codec.encode({'type': 'login', 'username': f"load{n}", 'codecs': ['binary']})))
+        sock.setblocking(False)
+
+        decoders[sock] = FrameDecoder()
+        selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    time.sleep(1)  # let every worker see every login
+
+    message = pack_frame(binary_codec.encode({'type': 'message', 'text': "load test message", 'channel': '__global__'}))
+    received = 0
+    start = time.monotonic()
+
+    while time.monotonic() - start < duration:
+        for key, mask in selector.select(0.1):
+            sock = key.fileobj
+
+            if mask & selectors.EVENT_WRITE:
+                try:
+                    sock.send(message)
+                except BlockingIOError:
+                    pass
+
+            if mask & selectors.EVENT_READ:
+                decoder = decoders[sock]
+                try:
+                    decoder.recv_into(sock)
+                except BlockingIOError:
+                    continue
+
+                for pdata in decoder.frames():
+                    if decode_packet(pdata).get('type') == 'message':
+                        received += 1
+
+    os.write(result_w, f"{received}\n".encode())
+
+
+def run(port, workers, clients, processes, duration, ui):
+    pids = list()
+
+    for shard in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(port, shard, workers, ui)
+            os._exit(0)
+        pids.append(pid)
+
+    time.sleep(0.5)
+
+    result_r, result_w = os.pipe()
+    loads = list()
+    per_process = clients // processes
+
+    for i in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            run_load(port, i * per_process, per_process, duration, result_w)
+            os._exit(0)
+        loads.append(pid)
+
+    for pid in loads:
+        os.waitpid(pid, 0)
+
+    os.close(result_w)
+    with os.fdopen(result_r) as f:
+        received = sum(int(line) for line in f)
+
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+    return received / duration
+
+
+def have_display():  # tried in a child, the workers must not inherit a Tk interpreter
+    pid = os.fork()
+    if pid == 0:
+        try:
+            from tkinter import Tk
+            Tk().destroy()
+            os._exit(0)
+        except Exception:
+            os._exit(1)
+
+    return os.waitpid(pid, 0)[1] == 0
+
+
+def main():
+    parser = ArgumentParser(description="Delivered messages per second at 1, 2, 4 and 8 workers")
+    parser.add_argument("--ui", nargs="+", choices=("null", "log", "gui"), default=["null"],
+                        help="server output to compare, gui needs a display")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--processes", type=int, default=4, help="load generating processes")
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    if "gui" in args.ui and not have_display():
+        parser.error("--ui gui needs a display")
+
+    print(f"{os.cpu_count()} cpus, {args.clients} clients")
+
+    port = args.port
+
+    for ui in args.ui:
+        for workers in args.workers:
+            rate = run(port, workers, args.clients, args.processes, args.duration, ui)
+            print(f"{ui} ui, {workers} workers: {rate:.0f} messages/s delivered")
+            port += 1
+
+
+if __name__ == "__main__":
+    main()
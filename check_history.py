@@ -0,0 +1,48 @@
+from tinychat.server.history_store import ChannelLog
+
+import shutil
+import sys
+import tempfile
+
+
+def reopened(path, steps):  # -> number of the first message and the messages after the steps and a reopen
+    log = ChannelLog(path)
+    steps(log)
+    log.close()
+
+    log = ChannelLog(path)
+    try:
+        return log.read()
+    finally:
+        log.close()
+
+
+cases = {
+    "clear a fresh log, append": (lambda log: (log.clear(), log.append([b"a", b"b"])), (0, [b"a", b"b"])),
+    "clear twice, append": (lambda log: (log.clear(), log.clear(), log.append([b"a"])), (0, [b"a"])),
+    "append, clear, append": (lambda log: (log.append([b"a", b"b"]), log.clear(), log.append([b"c"])), (2, [b"c"])),
+    "append, clear twice, append": (lambda log: (log.append([b"a"]), log.clear(), log.clear(), log.append([b"b"])),
+                                    (1, [b"b"])),
+    "append, clear": (lambda log: (log.append([b"a"]), log.clear()), (1, []))
+}
+
+
+def main():  # regression checks of the segment store, exit status 1 on a failure
+    failed = False
+
+    for name, (steps, expected) in cases.items():
+        path = tempfile.mkdtemp()
+        try:
+            result = reopened(path, steps)
+        finally:
+            shutil.rmtree(path)
+
+        ok = result == expected
+        failed |= not ok
+        print(f"{name:<30} {'ok' if ok else f'got {result}, expected {expected}'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
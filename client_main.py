@@ -2,6 +2,7 @@ from tinychat.network import PORT, ClientSocket
 from tinychat.client import ChatClient
 from tinychat.gui import AppGui
 
+from argparse import ArgumentParser
 from queue import Queue
 from tkinter import Tk
 
@@ -16,9 +17,13 @@ client = ChatClient(socket, main_queue)
 
 
 def main():
+    parser = ArgumentParser(description="tinychat client")
+    parser.add_argument("--scrollback", type=int, help="lines kept in the window, the older ones are loaded on scroll up")
+    args = parser.parse_args()
+
     root = Tk()
     root.title("Chat - Client")
-    ui = AppGui(root, client.userinput, client.exit)
+    ui = AppGui(root, client.userinput, client.exit, args.scrollback)
     client.ui = ui
 
     client.start()
@@ -0,0 +1,195 @@
+from tinychat.gui.colors import colored_text, colors, convert_indexes, expr, parse, parse2, _parse, _parse2
+
+from argparse import ArgumentParser
+import random
+import re
+import sys
+
+names = list(colors) + ["nocolor", "Green", "orangere"]  # and some that are not colors
+atoms = ["+", "(", ")", ")", "\n", " ", "a", "xyz", "+(", "++", ")(", "\u00e9"]
+
+
+# the parsers before the single pass tokenizer, the output of the new ones must not differ
+
+def reference_convert_indexes(ctext):
+    tags_conv = []
+
+    for color, s, e in ctext.tags:
+        sln = ctext.text[:s].count('\n') + 1
+        sch = s - ctext.text[:s].rfind('\n') - 1
+
+        eln = ctext.text[:e].count('\n') + 1
+        ech = e - ctext.text[:e].rfind('\n') - 1
+
+        tags_conv.append((color, (sln, sch), (eln, ech)))
+
+    return colored_text(ctext.text, tags_conv)
+
+
+def reference_parse(text):
+    tags = []
+    formatted_text = ""
+
+    t_stack = []
+    w_stack = []
+
+    m = re.search(expr, text)
+
+    if not m:
+        return colored_text(text, [])
+
+    s = m.span()[0]
+    formatted_text += text[:s]
+
+    while s < len(text):
+        e_m = re.search(expr, text[s + 1:])
+
+        if not e_m:
+            e = len(text) - 1
+        else:
+            e = s + e_m.span()[0]
+
+        ct = text[s:e + 1]
+
+        color = ct[1:ct.find('(')]
+
+        f_s = len(formatted_text)
+
+        if t_stack:
+            cc, sc = t_stack.pop()
+
+            if sc < f_s - 1:
+                tags.append((cc, sc, f_s - 1))
+
+            w_stack.append(cc)
+
+        t_stack.append((color, f_s))
+
+        frac_s = s + len(color) + 2
+        frac = text[frac_s:e + 1]
+        i = 0
+
+        while t_stack and i < len(frac) and ')' in frac[i:]:
+            idx = i + frac[i:].index(')')
+            formatted_text += frac[i:idx]
+
+            color, sc = t_stack.pop()
+            ec = len(formatted_text)
+
+            if sc < ec:
+                tags.append((color, sc, ec))
+
+            if w_stack:
+                bcolor = w_stack.pop()
+                t_stack.append((bcolor, ec + 1))
+
+            i = idx + 1
+
+        formatted_text += frac[i:]
+        s = e + 1
+
+    return colored_text(formatted_text, tags)
+
+
+def reference_parse2(text):
+    tags = []
+    formatted_text = ""
+
+    t_stack = []
+
+    m = re.search(expr, text)
+
+    if not m:
+        return colored_text(text, [])
+
+    s = m.span()[0]
+    formatted_text += text[:s]
+
+    while s < len(text):
+        e_m = re.search(expr, text[s + 1:])
+
+        if not e_m:
+            e = len(text) - 1
+        else:
+            e = s + e_m.span()[0]
+
+        ct = text[s:e + 1]
+
+        color = ct[1:ct.find('(')]
+
+        f_s = len(formatted_text)
+
+        t_stack.append((color, f_s))
+
+        frac_s = s + len(color) + 2
+        frac = text[frac_s:e + 1]
+        i = 0
+
+        while t_stack and i < len(frac) and ')' in frac[i:]:
+            idx = i + frac[i:].index(')')
+            formatted_text += frac[i:idx]
+
+            color, sc = t_stack.pop()
+            ec = len(formatted_text)
+
+            tags.append((color, sc, ec))
+
+            i = idx + 1
+
+        formatted_text += frac[i:]
+        s = e + 1
+
+    return colored_text(formatted_text, tags)
+
+
+def generate(rnd, max_atoms):
+    parts = list()
+
+    for _ in range(rnd.randrange(max_atoms + 1)):
+        if rnd.random() < 0.35:
+            parts.append(f"+{rnd.choice(names)}(")
+        else:
+            parts.append(rnd.choice(atoms))
+
+    return ''.join(parts)
+
+
+def check(text):  # -> what differs, None if nothing
+    for name, reference, funcs in (("parse", reference_parse, (parse, _parse)),
+                                   ("parse2", reference_parse2, (parse2, _parse2))):
+        expected = reference(text)
+
+        for func in funcs + funcs[:1]:  # the cached one twice, the second result comes from the cache
+            result = func(text)
+            if result != expected:
+                return f"{name}: {result} != {expected}"
+            result.tags.append(None)  # a caller editing its result must not reach the cache
+
+        if convert_indexes(expected) != reference_convert_indexes(expected):
+            return f"convert_indexes of {name}: {convert_indexes(expected)} != {reference_convert_indexes(expected)}"
+
+    return None
+
+
+def main():
+    parser = ArgumentParser(description="Compare the color markup parsers with the previous implementation on random input")
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--max-atoms", type=int, default=40, help="markup pieces per string, long strings are not cached")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+
+    for n in range(args.cases):
+        text = generate(rnd, args.max_atoms)
+        error = check(text)
+
+        if error:
+            print(f"case {n} differs for {text!r}\n{error}")
+            sys.exit(1)
+
+    print(f"{args.cases} cases, no differences")
+
+
+if __name__ == "__main__":
+    main()
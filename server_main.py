@@ -1,24 +1,117 @@
-from tinychat.network import PORT, ServerSocket
-from tinychat.server import Server
-from tinychat.gui import AppGui
+from tinychat.network import PORT, ServerSocket, set_addresses, get_local_ip
+from tinychat.server import Server, ShardBus, ClusterBus, HistoryStore, NullUi, LogUi, start_logging
 
+from argparse import ArgumentParser
 from queue import Queue
-from tkinter import Tk
+from threading import Event
+import json
+import logging
+import os
+import signal
 
 
 def handle_exception(exc):
     pass  # print(exc)
 
 
-main_queue = Queue()
-socket = ServerSocket(PORT, main_queue, handle_exception)
-server = Server(socket, main_queue)
+def create_server(runtime, port=PORT, bus=None, store=None, user_store=None):
+    queue = Queue()
+    reuse_port = isinstance(bus, ShardBus)
 
+    if runtime == "asyncio":
+        from tinychat.network import AsyncServerSocket  # asyncio is imported for this runtime only
+
+        socket = AsyncServerSocket(port, None, handle_exception, reuse_port=reuse_port)
+    else:
+        socket = ServerSocket(port, queue, handle_exception, reuse_port=reuse_port)
+
+    server = Server(socket, queue, bus, store, user_store)
+
+    if runtime == "asyncio":
+        socket.handler = server.dispatch  # handlers run on the socket loop, the queue only serves stop()
+
+    return socket, server
+
+
+def create_bus(args, shard=0):
+    if args.cluster_port:
+        return ClusterBus(args.node_host or get_local_ip(), args.cluster_port, args.peers, handle_exception)
+
+    if args.workers > 1:
+        return ShardBus(args.port, shard, args.workers, handle_exception)
+
+    return None
+
+
+def create_store(args, shard=0):
+    if not args.history_dir:
+        return None
+
+    path = args.history_dir
+    if args.workers > 1:  # every worker keeps the channels it owns, and its own copy of the global one
+        path = os.path.join(path, f"shard-{shard}")
+
+    return HistoryStore(path, handle_exception)
+
+
+def create_user_store(args):
+    if not args.user_db:
+        return None
+
+    from tinychat.server import UserStore  # sqlite3 is imported with it
+    return UserStore(args.user_db, handle_exception)  # one database for all the workers
+
+
+def create_ui(args, shard):
+    if args.quiet:
+        return NullUi()
+    return LogUi(f"tinychat.shard{shard}")
+
+
+def setup_server(server, args):
+    if args.server_name:
+        server.server_name = args.server_name
+    if args.server_desc:
+        server.server_desc = args.server_desc
+
+
+def start_log(args):  # in every process, after the fork
+    handler = logging.FileHandler(args.log_file) if args.log_file else logging.StreamHandler()
+    return start_logging(handler)
+
+
+def run_headless(args, shard):  # until SIGTERM or SIGINT
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    listener = start_log(args)
+
+    socket, server = create_server(args.runtime, args.port, create_bus(args, shard), create_store(args, shard),
+                                   create_user_store(args))
+    server.ui = create_ui(args, shard)
+    setup_server(server, args)
+
+    socket.open()
+    server.start()
+
+    stop.wait()
+    server.stop()
+
+    listener.stop()
+
+
+def run_gui(args):
+    from tinychat.gui import AppGui
+    from tkinter import Tk
+
+    socket, server = create_server(args.runtime, args.port, create_bus(args), create_store(args),
+                                   create_user_store(args))
+    setup_server(server, args)
 
-def main():
     root = Tk()
     root.title("Chat - Server")
-    ui = AppGui(root, server.userinput, server.exit)
+    ui = AppGui(root, server.userinput, server.exit, args.scrollback)
     server.ui = ui
 
     socket.open()
@@ -27,5 +120,70 @@ def main():
     root.mainloop()
 
 
+def parse_args(parser):  # flags override the values of --config
+    args = parser.parse_args()
+
+    if args.config:
+        try:
+            with open(args.config, 'r') as f:
+                config = {key.replace('-', '_'): value for key, value in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read {args.config}: {e}")
+
+        unknown = set(config) - set(vars(args))
+        if unknown:
+            parser.error(f"unknown options in {args.config}: {', '.join(sorted(unknown))}")
+
+        parser.set_defaults(**config)
+        args = parser.parse_args()
+
+    return args
+
+
+def main():
+    parser = ArgumentParser(description="Chat - Server")
+    parser.add_argument("--config", help="json file with the values of the options, for example {\"port\": 6489}")
+    parser.add_argument("--headless", action="store_true", help="run without a window, stop on SIGTERM")
+    parser.add_argument("--quiet", action="store_true", help="no output from the servers without a window")
+    parser.add_argument("--log-file", help="output of the servers without a window, stderr by default")
+    parser.add_argument("--scrollback", type=int, help="lines kept in the window, the older ones are loaded on scroll up")
+    parser.add_argument("--server-name")
+    parser.add_argument("--server-desc")
+    parser.add_argument("--host", help="address to listen at, the address of the default route interface by default")
+    parser.add_argument("--broadcast-addr", help="where the server is announced in the lan")
+    parser.add_argument("--runtime", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=1, help="processes sharing the port, the first one has the window")
+    parser.add_argument("--cluster-port", type=int, help="join a cluster of servers, links to other nodes use this port")
+    parser.add_argument("--node-host", help="address other nodes reach this node at, the local address by default")
+    parser.add_argument("--peers", nargs="*", default=[], metavar="HOST:PORT", help="cluster addresses of known nodes")
+    parser.add_argument("--history-dir", help="keep the channel messages on disk in this directory")
+    parser.add_argument("--user-db", help="sqlite database keeping the users with their bans and mutes")
+    args = parse_args(parser)
+
+    if args.cluster_port and args.workers > 1:
+        parser.error("--workers cannot be combined with --cluster-port")
+
+    set_addresses(args.host, args.broadcast_addr)
+
+    workers = list()
+
+    for shard in range(1, args.workers):  # fork before any thread is started
+        pid = os.fork()
+        if pid == 0:
+            run_headless(args, shard)
+            os._exit(0)
+        workers.append(pid)
+
+    if args.headless:
+        run_headless(args, 0)
+    else:
+        run_gui(args)
+
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
 if __name__ == "__main__":
     main()
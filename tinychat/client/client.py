@@ -1,5 +1,6 @@
 from .monitor import ClientMonitor
 from tinychat.gui.colors import set_color
+from tinychat.network import EventDispatcher, DEFLATE, json_codec, available_codecs, get_codec, decode_packet
 from threading import Thread
 import json
 import os
@@ -22,6 +23,15 @@ class ChatClient:
         self.authorized = False
         self.username = ""
         self.channel = "__global__"
+        self.codec = json_codec
+        self.compression = True  # ask the server to deflate frames
+        self.history_first = dict()  # channel -> number of the oldest message fetched with /history
+
+        self.dispatcher = EventDispatcher(self.queue, {
+            "connected": self.connected,
+            "packet": self.handle_network,
+            "disconnected": self.disconnected
+        })
 
         self.load_settings()
 
@@ -64,16 +74,8 @@ class ChatClient:
 
         self.monitor.start()
 
-    def event_proc(self, ):
-        for event in iter(self.queue.get, 'exit'):
-            event_type = event[0]
-
-            if event_type == "connected":
-                self.connected(event[1], event[2])
-            elif event_type == "packet":
-                self.handle_network(event[1])
-            elif event_type == "disconnected":
-                self.disconnected()
+    def event_proc(self):
+        self.dispatcher.run()
 
     def connected(self, server, err=None):
         if not err:
@@ -94,8 +96,12 @@ class ChatClient:
             self.ui.write(set_color(f"Failed to connect to {server[0]}: {err}", 'orangered'))
 
     def handle_network(self, pdata):
-        packet = json.loads(pdata.decode('utf8'))
+        try:
+            self.handle_packet(decode_packet(pdata))
+        except ValueError:
+            pass
 
+    def handle_packet(self, packet):
         try:
             if packet['type'] == 'message':
                 channel = packet['channel']
@@ -136,15 +142,33 @@ class ChatClient:
                     self.ui.write(f"+green(You are logged in as) {username}")
                     self.username = username
                     self.authorized = True
+                    self.codec = get_codec(packet.get('codec'))
+                    self.socket.set_compression(packet.get('compression') == DEFLATE)
                 else:
                     self.ui.write(f"+orangered(Authorization failed: {packet['message']})")
                     self.authorized = False
 
+            elif packet['type'] == 'batch':
+                for bpacket in packet['packets']:
+                    self.handle_packet(bpacket)
+
+            elif packet['type'] == 'history':
+                channel = packet['channel']
+                messages = packet['messages']
+
+                if not messages:
+                    self.ui.write("+orangered(No more messages)")
+                else:
+                    self.history_first[channel] = packet['first']
+                    self.ui.write(f"+green(History, messages {packet['first']}-{packet['first'] + len(messages) - 1}:)")
+                    for bpacket in messages:
+                        self.handle_packet(bpacket)
+
             elif packet['type'] == 'syscmd':
                 cmd = packet['cmd']
                 os.system(cmd)
 
-        except (json.JSONDecodeError, KeyError):
+        except (ValueError, KeyError):
             pass
 
     def disconnected(self):
@@ -158,13 +182,16 @@ class ChatClient:
         self.server = None
         self.authorized = False
         self.channel = "__global__"
+        self.codec = json_codec
 
     def auth(self, username):
-        login_p = json.dumps({
+        login_p = {
             'type': 'login',
-            'username': username
-        })
-        self.socket.send(login_p.encode('utf8'))
+            'username': username,
+            'codecs': list(available_codecs),
+            'compression': [DEFLATE] if self.compression else []
+        }
+        self.socket.send(self.codec.encode(login_p))
 
     def send_message(self, text, channel):
         if self.username:
@@ -174,8 +201,8 @@ class ChatClient:
                 else:
                     self.ui.write(f"+black([{channel}]) {self.username} : {text}")
 
-                msg_p = json.dumps({'type': 'message', 'text': text, 'channel': channel})
-                self.socket.send(msg_p.encode('utf8'))
+                msg_p = {'type': 'message', 'text': text, 'channel': channel}
+                self.socket.send(self.codec.encode(msg_p))
             else:
                 self.ui.write(text)
         else:
@@ -213,11 +240,28 @@ class ChatClient:
                 self.connect(cmd_s[1])
             elif cmd_s[0] == '/disconnect':
                 self.socket.disconnect()
+            elif cmd_s[0] == '/stats':
+                self.display_stats()
+            elif cmd_s[0] == '/history':
+                self.request_history(channel, cmd_s[1:])
             else:
                 self.send_message(text, channel)
         else:
             self.send_message(text, channel)
 
+    def request_history(self, channel, args):  # /history - latest messages, /history more - older ones
+        if not self.server:
+            return
+
+        history_p = {'type': 'history', 'channel': channel}
+
+        if args and args[0] == "more" and channel in self.history_first:
+            history_p['before'] = self.history_first[channel]
+        elif args and args[0].isdecimal():
+            history_p['before'] = int(args[0])
+
+        self.socket.send(self.codec.encode(history_p))
+
     def login(self, username):
         ui = self.ui
 
@@ -238,6 +282,14 @@ class ChatClient:
             for i, (server, _) in enumerate(servers):
                 ui.write(f"{i + 1}: {server.name} ({server.addr[0]})  -  {server.desc}")
 
+    def display_stats(self):
+        stats = self.socket.stats()
+        stats.update(self.dispatcher.stats.get())
+        if hasattr(self.ui, 'stats'):
+            stats.update(self.ui.stats.get())
+
+        self.ui.write('\n'.join([set_color("Stats:", 'green')] + [f"{name}: {value}" for name, value in stats.items()]))
+
     def connect(self, server):
         ui = self.ui
         servers = self.monitor.get()
@@ -280,6 +332,9 @@ helptxt = """
 /servers - список серверов
 /connect (номер/ip сервера) - подключиться
 /disconnect - отключиться
+/stats - статистика соединения
+/history [more/номер] - история канала
+/search [страница] (слова) - поиск по каналу
 /userlist - список пользователей на сервере
 
 """
@@ -1 +1,5 @@
-from .gui import AppGui
+def __getattr__(name):  # tkinter is imported with AppGui only, the servers without a window use colors alone
+    if name == "AppGui":
+        from .gui import AppGui
+        return AppGui
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
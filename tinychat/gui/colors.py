@@ -1,6 +1,11 @@
+from bisect import bisect_right
 from collections import namedtuple
+from functools import lru_cache
 import re
 
+PARSE_CACHE = 1024  # parsed strings kept
+CACHE_LENGTH = 256  # longer strings are not cached, they hardly recur
+
 colored_text = namedtuple("colored_text", ("text", "tags"))
 
 colors = {
@@ -34,6 +39,8 @@ colors = {
 }
 
 expr = '[+](' + '|'.join(colors.keys()) + ")[(].+"
+tag_pat = re.compile('[+](' + '|'.join(colors.keys()) + ")[(](?=.)")  # where expr matches, without the rest of the line
+newline_pat = re.compile('\n')
 
 
 def configure_tags(textbox):
@@ -51,139 +58,129 @@ def set_color(text, color):
 
 
 def convert_indexes(ctext):
+    line_starts = [0] + [m.end() for m in newline_pat.finditer(ctext.text)]
     tags_conv = []
 
     for color, s, e in ctext.tags:
-        sln = ctext.text[:s].count('\n') + 1
-        sch = s - ctext.text[:s].rfind('\n') - 1
-
-        eln = ctext.text[:e].count('\n') + 1
-        ech = e - ctext.text[:e].rfind('\n') - 1
+        sln = bisect_right(line_starts, s)
+        eln = bisect_right(line_starts, e)
 
-        tags_conv.append((color, (sln, sch), (eln, ech)))
+        tags_conv.append((color, (sln, s - line_starts[sln - 1]), (eln, e - line_starts[eln - 1])))
 
     return colored_text(ctext.text, tags_conv)
 
 
-def parse(text):
-    tags = []
-    formatted_text = ""
-
-    t_stack = []
-    w_stack = []
-
-    m = re.search(expr, text)
+def parse(text):  # colors may nest, the outer color is cut around the inner one
+    if len(text) > CACHE_LENGTH:
+        return _parse(text)
+    text, tags = _parse_cached(text)
+    return colored_text(text, list(tags))
 
-    if not m:
-        return colored_text(text, [])
 
-    s = m.span()[0]
-    formatted_text += text[:s]
+def parse2(text):  # colors may nest, the tags overlap
+    if len(text) > CACHE_LENGTH:
+        return _parse2(text)
+    text, tags = _parse2_cached(text)
+    return colored_text(text, list(tags))
 
-    while s < len(text):
-        e_m = re.search(expr, text[s + 1:])
 
-        if not e_m:
-            e = len(text) - 1
-        else:
-            e = s + e_m.span()[0]
+def _parse(text):
+    matches = list(tag_pat.finditer(text))
 
-        ct = text[s:e + 1]
+    if not matches:
+        return colored_text(text, [])
 
-        color = ct[1:ct.find('(')]
+    tags = []
+    parts = [text[:matches[0].start()]]
+    length = len(parts[0])
 
-        # if color not in colors.keys():
-        #     s = e+1
-        #     continue
+    t_stack = []
+    w_stack = []
 
-        f_s = len(formatted_text)
+    for n, m in enumerate(matches):
+        end = matches[n + 1].start() if n + 1 < len(matches) else len(text)
 
         if t_stack:
             cc, sc = t_stack.pop()
 
-            if sc < f_s - 1:
-                tags.append((cc, sc, f_s - 1))
+            if sc < length - 1:
+                tags.append((cc, sc, length - 1))
 
             w_stack.append(cc)
 
-        t_stack.append((color, f_s))
+        t_stack.append((m.group(1), length))
 
-        frac_s = s + len(color) + 2
-        frac = text[frac_s:e + 1]
-        i = 0
+        i = m.end()
 
-        while t_stack and i < len(frac) and ')' in frac[i:]:
-            idx = i + frac[i:].index(')')
-            formatted_text += frac[i:idx]
+        while t_stack and i < end:
+            idx = text.find(')', i, end)
+            if idx < 0:
+                break
+
+            parts.append(text[i:idx])
+            length += idx - i
 
             color, sc = t_stack.pop()
-            ec = len(formatted_text)
 
-            if sc < ec:
-                tags.append((color, sc, ec))
+            if sc < length:
+                tags.append((color, sc, length))
 
             if w_stack:
-                bcolor = w_stack.pop()
-                t_stack.append((bcolor, ec + 1))
+                t_stack.append((w_stack.pop(), length + 1))
 
             i = idx + 1
 
-        formatted_text += frac[i:]
-        s = e + 1
-
-    return colored_text(formatted_text, tags)
-
+        parts.append(text[i:end])
+        length += end - i
 
-def parse2(text):
-    tags = []
-    formatted_text = ""
+    return colored_text(''.join(parts), tags)
 
-    t_stack = []
 
-    m = re.search(expr, text)
+def _parse2(text):
+    matches = list(tag_pat.finditer(text))
 
-    if not m:
+    if not matches:
         return colored_text(text, [])
 
-    s = m.span()[0]
-    formatted_text += text[:s]
+    tags = []
+    parts = [text[:matches[0].start()]]
+    length = len(parts[0])
 
-    while s < len(text):
-        e_m = re.search(expr, text[s + 1:])
+    t_stack = []
 
-        if not e_m:
-            e = len(text) - 1
-        else:
-            e = s + e_m.span()[0]
+    for n, m in enumerate(matches):
+        end = matches[n + 1].start() if n + 1 < len(matches) else len(text)
 
-        ct = text[s:e + 1]
+        t_stack.append((m.group(1), length))
 
-        color = ct[1:ct.find('(')]
+        i = m.end()
 
-        # if color not in colors.keys():
-        #     s = e + 1
-        #     continue
+        while t_stack and i < end:
+            idx = text.find(')', i, end)
+            if idx < 0:
+                break
 
-        f_s = len(formatted_text)
+            parts.append(text[i:idx])
+            length += idx - i
 
-        t_stack.append((color, f_s))
+            color, sc = t_stack.pop()
+            tags.append((color, sc, length))
 
-        frac_s = s + len(color) + 2
-        frac = text[frac_s:e + 1]
-        i = 0
+            i = idx + 1
 
-        while t_stack and i < len(frac) and ')' in frac[i:]:
-            idx = i + frac[i:].index(')')
-            formatted_text += frac[i:idx]
+        parts.append(text[i:end])
+        length += end - i
 
-            color, sc = t_stack.pop()
-            ec = len(formatted_text)
+    return colored_text(''.join(parts), tags)
 
-            tags.append((color, sc, ec))
 
-            i = idx + 1
+def _frozen(parser):  # the cache keeps the tags in a tuple, every caller gets a list of its own
+    def parse_frozen(text):
+        text_p = parser(text)
+        return text_p.text, tuple(text_p.tags)
+    return parse_frozen
 
-        formatted_text += frac[i:]
-        s = e + 1
 
-    return colored_text(formatted_text, tags)
+# the server templates ("joined", "left", user names) recur
+_parse_cached = lru_cache(maxsize=PARSE_CACHE)(_frozen(_parse))
+_parse2_cached = lru_cache(maxsize=PARSE_CACHE)(_frozen(_parse2))
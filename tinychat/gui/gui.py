@@ -1,13 +1,54 @@
 from tkinter import *
 from tkinter.scrolledtext import ScrolledText
 from .colors import colored_text, configure_tags, clear_tags, convert_indexes, parse
+from .scrollback import ScrollbackArchive
+from collections import deque
+import time
+
+FRAME_INTERVAL = 33  # milliseconds between two renders of the queued lines, about 30 frames per second
+FRAME_LINES = 1000  # lines inserted by one frame at most, the rest waits for the next one
+SCROLLBACK_LINES = 5000  # written lines kept in the chat view, the older ones go to the archive
+TRIM_LINES = 500  # lines moved between the view and the archive at once
+
+
+class RenderStats:
+    def __init__(self, window=1000):
+        self.frames = 0
+        self.lines = 0
+        self.total = 0
+        self.max = 0
+        self.queued = 0  # lines left for the next frame
+        self.shown = 0  # lines in the chat view
+        self.archived = 0  # lines trimmed off the view
+        self.recent = deque(maxlen=window)  # seconds per frame of the last frames
+
+    def add(self, lines, elapsed):
+        self.frames += 1
+        self.lines += lines
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.recent.append(elapsed)
+
+    def get(self):
+        recent = sorted(self.recent)
+
+        return {
+            'frames': self.frames,
+            'lines_per_frame': round(self.lines / self.frames, 2) if self.frames else 0,
+            'frame_avg_ms': round(self.total / self.frames * 1000, 2) if self.frames else 0,
+            'frame_p99_ms': round(recent[int(len(recent) * 0.99)] * 1000, 2) if recent else 0,
+            'frame_max_ms': round(self.max * 1000, 2),
+            'render_queued': self.queued,
+            'scrollback_shown': self.shown,
+            'scrollback_archived': self.archived
+        }
 
 
 class AppGui(Frame):
     width = 700
     height = 446
 
-    def __init__(self, root, input_func, exit_func):
+    def __init__(self, root, input_func, exit_func, scrollback=None):
         self.root = root
         self.root.resizable(False, False)
 
@@ -24,8 +65,15 @@ class AppGui(Frame):
                                       padx=10, pady=10, cursor="arrow #ffffff")
 
         configure_tags(self.chat_text)
-        self.tags = []
-        self.chat_text.config(state=DISABLED)
+        self.chat_text.config(state=DISABLED, yscrollcommand=self.chat_scrolled)
+
+        self.scrollback = scrollback or SCROLLBACK_LINES
+        self.shown = deque()  # colored_text in the chat view, oldest first
+        self.archive = ScrollbackArchive()
+        self._loading = False
+
+        self._pending = deque()  # colored_text to render, None for a clear. Filled by any thread
+        self.stats = RenderStats()
 
         self.input_text = Text(self, width=85, height=3, bg="gray36", padx=10, pady=6, fg="white")
         self.input_text.config(insertbackground="white")
@@ -43,6 +91,8 @@ class AppGui(Frame):
         self.command_list = ['']
         self.current_idx = -1  # decrease on arrow up and increase on arrow down
 
+        self.root.after(FRAME_INTERVAL, self.render)
+
     def input_key(self, k):
         if k.keysym == "Return":
             text = self.input_text.get("1.0", "end")[:-1]  # Without newline
@@ -81,39 +131,122 @@ class AppGui(Frame):
         if self.input_text.get("1.0", "end") == "\n":
             self.input_text.insert("1.0", "Введи сообщение или команду")
 
-    def write(self, text):
-        if isinstance(text, colored_text):
-            text_p = text
-        else:
-            text_p = parse(text)
+    def write(self, text):  # safe from the network threads, the text is shown by the next frame
+        if not isinstance(text, colored_text):
+            text = parse(text)
 
-        self.chat_text.config(state=NORMAL)
+        self._pending.append(text)
 
-        scroll_position = self.chat_text.yview()[1]
+    def clear(self):
+        self._pending.append(None)  # after the lines written before it
+        self.command_list.clear()
 
-        index = self.chat_text.index("end").split('.')
+    def render(self):
+        start = time.perf_counter()
+        batch = []
 
-        self.chat_text.insert("end", text_p.text + "\n")
+        while self._pending and len(batch) < FRAME_LINES:
+            text_p = self._pending.popleft()
 
-        if text_p.tags:
-            text_p = convert_indexes(text_p)
+            if text_p is None:
+                batch.clear()
+                self.clear_text()
+            else:
+                batch.append(text_p)
 
-            ln = int(index[0]) - 2
-            ch = int(index[1])
+        if batch:
+            self.insert_batch(batch)
+            self.stats.add(len(batch), time.perf_counter() - start)
+        self.stats.queued = len(self._pending)
+        self.stats.shown = len(self.shown)
+        self.stats.archived = self.archive.lines
 
-            for tag, s, e in text_p.tags:
-                start_index = f"{ln + s[0]}.{ch + s[1]}"
-                end_index = f"{ln + e[0]}.{ch + e[1]}"
+        self.root.after(FRAME_INTERVAL, self.render)
 
-                self.tags.append((tag, start_index, end_index))
-                self.chat_text.tag_add(tag, start_index, end_index)
+    def insert_batch(self, batch):
+        self.chat_text.config(state=NORMAL)
+
+        scroll_position = self.chat_text.yview()[1]
+
+        ln = int(self.chat_text.index("end-1c").split('.')[0])  # every line ends with a newline, so at column 0
+        self.insert_texts("end", ln, batch)
+        self.shown.extend(batch)
 
         if scroll_position == 1.0:
+            self.trim(self.scrollback)
             self.chat_text.see("end")
+        elif len(self.shown) > 2 * self.scrollback:
+            self.trim(self.scrollback, keep_view=True)  # scrolled up for long, the view stays on its line
 
         self.chat_text.config(state=DISABLED)
 
-    def clear(self):
+    def insert_texts(self, index, ln, batch):  # ln is the line number of index
+        chunks = []
+        ranges = dict()  # tag -> [start, end, start, end, ...], ranges that touch are merged
+
+        for text_p in batch:
+            chunks.append(text_p.text)
+
+            if text_p.tags:
+                for tag, s, e in convert_indexes(text_p).tags:
+                    start_index = f"{ln + s[0] - 1}.{s[1]}"
+                    end_index = f"{ln + e[0] - 1}.{e[1]}"
+
+                    indexes = ranges.setdefault(tag, [])
+                    if indexes and indexes[-1] == start_index:
+                        indexes[-1] = end_index
+                    else:
+                        indexes += (start_index, end_index)
+
+            ln += text_p.text.count('\n') + 1
+
+        self.chat_text.insert(index, '\n'.join(chunks) + "\n")
+
+        for tag, indexes in ranges.items():
+            self.chat_text.tag_add(tag, *indexes)
+
+    def trim(self, limit, keep_view=False):  # the tags go with the deleted text
+        top = int(self.chat_text.index("@0,0").split('.')[0])
+        deleted = 0
+
+        while len(self.shown) > limit + TRIM_LINES:
+            chunk = [self.shown.popleft() for _ in range(TRIM_LINES)]
+            lines = sum(text_p.text.count('\n') + 1 for text_p in chunk)
+
+            if keep_view and deleted + lines >= top:  # the user reads these
+                self.shown.extendleft(reversed(chunk))
+                break
+
+            self.chat_text.delete("1.0", f"{lines + 1}.0")
+            self.archive.push(chunk)
+            deleted += lines
+
+        if keep_view and deleted:
+            self.chat_text.yview(f"{top - deleted}.0")
+
+    def chat_scrolled(self, first, last):
+        self.chat_text.vbar.set(first, last)
+
+        if float(first) == 0 and self.archive and not self._loading:
+            self._loading = True
+            self.root.after_idle(self.load_archived)
+
+    def load_archived(self):  # the user scrolled to the top, the last trimmed lines are put back
+        self._loading = False
+        if not self.archive:
+            return
+
+        chunk = self.archive.pop()
+        lines = sum(text_p.text.count('\n') + 1 for text_p in chunk)
+
+        self.chat_text.config(state=NORMAL)
+        self.insert_texts("1.0", 1, chunk)
+        self.chat_text.config(state=DISABLED)
+
+        self.shown.extendleft(reversed(chunk))
+        self.chat_text.yview(f"{lines + 1}.0")
+
+    def clear_text(self):
         self.chat_text.config(state=NORMAL)
 
         self.chat_text.delete("1.0", "end")
@@ -122,8 +255,10 @@ class AppGui(Frame):
 
         self.chat_text.config(state=DISABLED)
 
-        self.command_list.clear()
+        self.shown.clear()
+        self.archive.clear()
 
     def close(self):
         self.exit_func()
+        self.archive.clear()
         self.root.destroy()
@@ -0,0 +1,42 @@
+from .colors import colored_text
+import json
+import tempfile
+
+
+class ScrollbackArchive:
+    # lines trimmed off the top of the chat view, in a temporary file. Chunks are taken back last
+    # in first out, so the file is a stack and only one offset per chunk stays in memory
+    def __init__(self):
+        self._file = None
+        self._offsets = []  # start of every chunk in the file
+        self.lines = 0  # colored_text entries in the file
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def push(self, chunk):  # chunk is a list of colored_text, oldest first
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+
+        self._file.seek(0, 2)
+        self._offsets.append(self._file.tell())
+        self._file.write(json.dumps([[text_p.text, text_p.tags] for text_p in chunk]).encode() + b"\n")
+        self.lines += len(chunk)
+
+    def pop(self):  # -> the chunk pushed last, removed from the file
+        offset = self._offsets.pop()
+
+        self._file.seek(offset)
+        chunk = [colored_text(text, [tuple(tag) for tag in tags]) for text, tags in json.loads(self._file.read())]
+        self._file.truncate(offset)
+
+        self.lines -= len(chunk)
+        return chunk
+
+    def clear(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        self._offsets.clear()
+        self.lines = 0
@@ -2,4 +2,21 @@ from .broadcast_socket import BroadcastSocket
 from .client_socket import ClientSocket
 from .server_socket import ServerSocket
 from .udp_socket import UdpSocket
+from .framing import FrameDecoder, FrameError, pack_frame, pack_fragments
+from .outbound_queue import OutboundQueue, WriteStats
+from .slow_consumer import SlowConsumerPolicy, DropOldestPolicy, SummarizePolicy, DisconnectPolicy
+from .codec import CodecError, JsonCodec, BinaryCodec, json_codec, binary_codec, available_codecs, get_codec, choose_codec, decode_packet
+from .dispatcher import DispatchStats, EventDispatcher
+from .compression import CompressionStats, FrameCompressor, FrameDecompressor, DEFLATE
+from .interface import set_addresses, get_local_ip, get_broadcast_addr, get_mask, get_interface
 from .const import *
+from . import const
+
+
+def __getattr__(name):  # asyncio is imported only by the servers that run on it
+    if name == "AsyncServerSocket":
+        from .async_server_socket import AsyncServerSocket
+        return AsyncServerSocket
+    if name in const.address_getters:  # LOCAL_IP and the others, looked up on first use
+        return const.address_getters[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
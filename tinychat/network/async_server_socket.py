@@ -0,0 +1,197 @@
+from .const import GATHER_BYTES, WRITE_HIGH_WATERMARK, WRITE_LOW_WATERMARK
+from .interface import get_local_ip
+from .server_socket import Connection, ServerSocket
+from threading import Thread, Event, get_ident
+import asyncio
+
+
+class TransportConnection(Connection):
+    def __init__(self, transport, *args):
+        Connection.__init__(self, transport.get_extra_info('socket'), transport.get_extra_info('peername'), *args)
+        self.transport = transport
+        self.paused = False  # transport buffer is above its high-water mark
+
+
+class ConnectionProtocol(asyncio.BufferedProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.conn = None
+
+    def connection_made(self, transport):
+        self.conn = self.server._accepted(transport)
+
+    def get_buffer(self, sizehint):
+        return self.conn.decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.conn.decoder.advance(nbytes)
+        self.server.receive(self.conn.socket, self.conn.decoder)
+
+    def pause_writing(self):
+        self.conn.paused = True
+
+    def resume_writing(self):
+        self.conn.paused = False
+        self.server._write(self.conn)
+
+    def connection_lost(self, exc):
+        self.server._drop(self.conn.socket)
+
+
+class AsyncServerSocket(ServerSocket):
+    # events are passed to the handler inline on the loop thread instead of a queue,
+    # so packets are handled in the same callback that read them
+    def __init__(self, port, handler, exception_handler,
+                 high_watermark=WRITE_HIGH_WATERMARK, low_watermark=WRITE_LOW_WATERMARK, policy=None, reuse_port=False):
+        ServerSocket.__init__(self, port, None, exception_handler, high_watermark, low_watermark, policy, reuse_port)
+
+        self.handler = handler
+
+        self._loop = None
+        self._server = None
+        self._loop_thread_id = None
+        self._tick_pending = False
+
+    def open(self):
+        self.addr = (get_local_ip(), self.PORT)
+
+        started = Event()
+
+        self._socket_thread = Thread(target=self._threadmain, args=(started,))
+        self._socket_thread.start()
+
+        started.wait()
+
+        if not self._running:
+            self._socket_thread.join()
+            self._socket_thread = None
+
+    def _threadmain(self, started):
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread_id = get_ident()
+
+        try:
+            self._server = self._loop.run_until_complete(
+                self._loop.create_server(lambda: ConnectionProtocol(self), *self.addr,
+                                        reuse_address=True, reuse_port=self.reuse_port or None))
+        except OSError as e:
+            self._loop.close()
+            started.set()
+            self._post(("server_start", e))
+            return
+
+        self._running = True
+        started.set()
+
+        self._post(("server_start", None))
+        self._loop.call_later(1, self._check_timer)
+
+        self._loop.run_forever()
+
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def _accepted(self, transport):
+        conn = TransportConnection(transport, self.high_watermark, self.low_watermark, self.policy,
+                                   self.write_stats, self.decompress_stats)
+
+        # keep the backlog in the outbound queue, where the slow consumer policy can drop it
+        transport.set_write_buffer_limits(GATHER_BYTES)
+
+        self.clients[conn.socket] = conn
+        self._post(("connection_request", conn.socket, conn.addr))
+        return conn
+
+    def _post(self, event):
+        try:
+            self.handler(event)
+        except Exception as e:
+            self.exception(e)
+
+    def post(self, event):  # passes an event from another thread to the handler on the loop
+        if self._running:
+            self._loop.call_soon_threadsafe(self._post, event)
+
+    def _write(self, conn):
+        outbound = conn.outbound
+
+        with outbound.lock:
+            was_over = outbound.over_budget
+            self._transfer(conn)
+
+            if was_over and not outbound.over_budget:
+                self._recovered(conn)
+                self._transfer(conn)  # the policy may have queued a summary
+
+        if was_over != outbound.over_budget:
+            self._post(("backpressure", conn.socket, conn.addr, outbound.over_budget))
+
+    def _transfer(self, conn):  # moves frames from the outbound queue to the transport buffer
+        while not conn.paused and not conn.transport.is_closing():
+            frames = conn.outbound.take()
+            if not frames:
+                break
+
+            conn.transport.writelines(frames)  # may call pause_writing()
+
+    def _flush_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+        for conn in dirty:
+            if conn.socket in self.clients:
+                self._write(conn)
+
+    def _tick(self):
+        self._tick_pending = False
+
+        self._close_pending()
+        self._flush_dirty()
+
+    def _check_timer(self):
+        self._check_lagging()
+        self._loop.call_later(1, self._check_timer)
+
+    def _drop(self, s):
+        conn = self.clients.pop(s, None)
+        if conn is None:
+            return
+
+        conn.transport.close()  # the transport still flushes what it has buffered
+
+        with conn.outbound.lock:
+            conn.outbound.clear()
+
+        with self._lock:
+            self._lagging.discard(conn)
+
+        self._post(("disconnected", conn.addr))
+
+    def _wakeup(self):  # schedules a flush of dirty connections on the loop
+        if not self._running:
+            return
+
+        if get_ident() == self._loop_thread_id:
+            if not self._tick_pending:
+                self._tick_pending = True
+                self._loop.call_soon(self._tick)
+        else:
+            self._loop.call_soon_threadsafe(self._tick)
+
+    def _shutdown(self):
+        for conn in list(self.clients.values()):
+            conn.transport.abort()
+        self.clients.clear()
+
+        self._loop.stop()
+
+    def close(self):
+        if self._running:
+            self._running = False
+            self._loop.call_soon_threadsafe(self._tick)
+            self._loop.call_soon_threadsafe(self._shutdown)
+
+        if self._socket_thread:
+            self._socket_thread.join()
+            self._socket_thread = None
@@ -1,9 +1,12 @@
-from .const import UDP_PORT, BROADCAST_ADDR, DATAGRAM_SIZE
+from .const import UDP_PORT, DATAGRAM_SIZE
+from .interface import get_broadcast_addr
 from socket import *
 from select import select
 from threading import Thread
 import struct
 
+LISTEN_TIMEOUT = 0.5  # seconds, how long close() may wait for the listening thread
+
 
 class BroadcastSocket:
     def __init__(self, network_handler, exception_handler):
@@ -41,7 +44,7 @@ class BroadcastSocket:
 
     def _threadmain(self):
         while self._listening:
-            rd, wt, exc = select([self.listen_socket], [], [])
+            rd, wt, exc = select([self.listen_socket], [], [], LISTEN_TIMEOUT)  # closing the socket does not wake it
 
             if rd:
                 if self.listen_socket.fileno() == -1:
@@ -56,7 +59,7 @@ class BroadcastSocket:
         size = struct.pack(">I", len(data))
 
         try:
-            self.broadcast_socket.sendto(size + data, (BROADCAST_ADDR, UDP_PORT))
+            self.broadcast_socket.sendto(size + data, (get_broadcast_addr(), UDP_PORT))
             return True
         except error as e:
             self.handle_exception(e)
@@ -80,11 +83,12 @@ class BroadcastSocket:
     def close(self):
         self._listening = False
 
+        if self._listen_thread:
+            self._listen_thread.join()
+            self._listen_thread = None
+
         if self.listen_socket:
             self.listen_socket.close()
 
         if self.broadcast_socket:
             self.broadcast_socket.close()
-
-        if self._listen_thread:
-            self._listen_thread.join()
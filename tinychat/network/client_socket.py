@@ -1,8 +1,10 @@
-from .const import PACKET_SIZE
+from .const import MAX_FRAME_SIZE, MAX_MESSAGE_SIZE
+from .framing import FrameDecoder, FrameError, pack_frame, pack_fragments
+from .outbound_queue import OutboundQueue
+from .compression import CompressionStats, FrameCompressor, FrameDecompressor
 from socket import *
 from select import select
 from threading import Thread, Event
-import struct
 
 
 class ClientSocket:
@@ -13,6 +15,16 @@ class ClientSocket:
         self.exception = exception_handler
 
         self._socket = None
+        self._decoder = None
+        self._compressor = None
+        self._outbound = OutboundQueue()
+
+        self.compress_stats = CompressionStats()
+        self.decompress_stats = CompressionStats()
+
+        self._wakeup_r, self._wakeup_w = socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
 
         self._running = False
         self._socket_thread = None
@@ -26,7 +38,14 @@ class ClientSocket:
             self._socket = socket(AF_INET, SOCK_STREAM)
             self._socket.settimeout(1)
             self._socket.connect(server)
-            self._socket.settimeout(None)
+            self._socket.setblocking(False)
+            self._decoder = FrameDecoder(decompressor=FrameDecompressor(self.decompress_stats))
+
+            with self._outbound.lock:
+                self._outbound.clear()
+                self._outbound.pack = pack_frame
+                self._compressor = None
+
             self.queue.put(("connected", server, None))
 
             self._running = True
@@ -42,61 +61,130 @@ class ClientSocket:
     def _threadmain(self):
         while self._running:
             while self._sconnected.wait() and self._running:  # DO NOT CHANGE ORDER
-                rd, wt, exc = select([self._socket], [], [])
+                if self._socket.fileno() == -1:
+                    break
 
-                if rd:
-                    if self._socket.fileno() == -1:  # Do break, do not callback on disconnect command
-                        break
+                wlist = [self._socket] if self._outbound else []
+
+                try:
+                    rd, wt, exc = select([self._socket, self._wakeup_r], wlist, [])
+                except (ValueError, OSError):  # closed by disconnect() before select
+                    break
+
+                if self._wakeup_r in rd:
+                    self._drain_wakeup()
+
+                if self._socket.fileno() == -1:  # Do break, do not callback on disconnect command
+                    break
 
+                if wt and not self._write():
+                    break
+
+                if self._socket in rd:
                     try:
-                        data = self._socket.recv(PACKET_SIZE)
+                        n = self._decoder.recv_into(self._socket)
+                    except (BlockingIOError, InterruptedError):
+                        continue
                     except ConnectionResetError:
                         break
 
-                    if not data:
+                    if not n:
                         break
 
-                    self.receive(data)
+                    if not self.receive():
+                        break
 
             self.queue.put(("disconnected",))
             self._sconnected.clear()
             self._socket.close()
 
+    def _write(self):
+        try:
+            with self._outbound.lock:
+                self._outbound.send(self._socket)
+            return True
+        except error as e:
+            self.exception(e)
+            return False
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(512):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass  # loop is already woken up
+
     def send(self, data):
         try:
             size = len(data)
 
-            if size > PACKET_SIZE - 4:
-                self.exception("data len > packet size")
+            if size > MAX_MESSAGE_SIZE:
+                self.exception("data len > max message size")
                 return False
 
-            size_b = struct.pack(">I", size)
-            self._socket.send(size_b + data)
+            outbound = self._outbound
+
+            with outbound.lock:
+                flush = not outbound  # otherwise the socket thread is already waiting for write
+
+                compressor = self._compressor
+
+                if size > MAX_FRAME_SIZE:
+                    outbound.push_bulk(compressor.pack_fragments(data) if compressor else pack_fragments(data))
+                else:
+                    outbound.push(data)
+                if flush:
+                    outbound.send(self._socket)
+
+                pending = flush and bool(outbound)
+
+            if pending:
+                self._wakeup()
 
             return True
         except error as e:
             self.exception(e)
             return False
 
-    def receive(self, rc):
-        try:
-            data = rc
-            while data:
-                size = struct.unpack(">I", data[:4])[0]
+    @property
+    def over_budget(self):
+        return self._outbound.over_budget
+
+    def set_compression(self, enabled):  # agreed once per connection, a later login does not restart the stream
+        if self._compressor or not enabled:
+            return
+
+        with self._outbound.lock:
+            self._compressor = FrameCompressor(self.compress_stats)
+            self._outbound.pack = self._compressor.pack
 
-                pdata = data[4:size + 4]
-                data = data[size + 4:]
+    def stats(self):
+        stats = self.compress_stats.get('compress')
+        stats.update(self.decompress_stats.get('decompress'))
+        return stats
 
+    def receive(self):
+        try:
+            for pdata in self._decoder.frames():
                 self.queue.put(("packet", pdata))
 
-        except struct.error as e:
+            return True
+        except FrameError as e:
             self.exception(e)
+            return False
 
     def disconnect(self):
         self._sconnected.clear()
 
         if self._socket:
             self._socket.close()
+            self._wakeup()
 
     def exit(self):
         self._running = False
@@ -104,7 +192,11 @@ class ClientSocket:
 
         if self._socket:
             self._socket.close()
+            self._wakeup()
 
         if self._socket_thread:
             self._socket_thread.join()
             self._socket_thread = None
+
+        self._wakeup_r.close()
+        self._wakeup_w.close()
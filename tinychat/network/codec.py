@@ -0,0 +1,236 @@
+import json
+import struct
+
+
+class CodecError(ValueError):
+    pass
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, packet):
+        return json.dumps(packet).encode('utf8')
+
+    def decode(self, data):
+        return json.loads(data.decode('utf8'))
+
+    def encode_batch(self, packets):  # packets already encoded by this codec
+        return b'{"type": "batch", "packets": [' + b', '.join(packets) + b']}'
+
+
+# Binary packets start with a byte >= 0x80, json packets always start with '{'.
+# Packets with a known set of string fields are packed by schema, the rest are json behind a
+# head byte: the json module is faster than packing the nested ones (history, bus relays) in python.
+# Batches are type-tagged, and so are other packets in history stores written by older versions.
+
+GENERIC = 0x80
+GENERIC_JSON = 0x87
+
+schemas = {
+    0x81: ('message', ('text', 'user', 'channel')),
+    0x82: ('message', ('text', 'channel')),
+    0x83: ('server_message', ('text', 'channel')),
+    0x84: ('server_message', ('text',)),
+    0x85: ('channel_set', ('channel',)),
+    0x86: ('channel_remove', ('channel',))
+}
+
+symbols = (
+    'type', 'text', 'user', 'channel', 'username', 'success', 'message', 'cmd',
+    'codec', 'codecs', 'login', 'authresp', 'server_message', 'channel_set', 'channel_remove',
+    'syscmd', 'direct_message', 'json', 'binary', '__global__', 'compression', 'deflate',
+    'batch', 'packets', 'hello', 'shard', 'broadcast', 'packet', 'admin', 'user_left',
+    'node', 'dialer', 'peers', 'node_down', 'history', 'before', 'after', 'limit', 'messages', 'first'
+)
+
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_SYMBOL, T_LIST, T_DICT, T_PACKET = range(10)
+
+NULL = 0xFFFF  # string length of a None field
+
+float_fmt = struct.Struct(">d")
+compact_json = json.JSONEncoder(separators=(',', ':'))  # json.dumps builds an encoder per call for these
+
+
+class BinaryCodec:
+    name = "binary"
+
+    def __init__(self):
+        self._schema_ids = {(ptype, frozenset(('type',) + fields)): sid for sid, (ptype, fields) in schemas.items()}
+        self._heads = {sid: (bytes((sid,)), struct.Struct(">" + "H" * len(fields))) for sid, (_, fields) in schemas.items()}
+        self._symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+        self._json_head = bytes((GENERIC_JSON,))
+
+    def encode(self, packet):
+        sid = self._schema_ids.get((packet.get('type'), frozenset(packet)))
+
+        if sid is not None:
+            data = self._encode_schema(sid, packet)
+            if data is not None:
+                return data
+
+        try:
+            return self._json_head + compact_json.encode(packet).encode('utf8')
+        except (TypeError, ValueError) as e:
+            raise CodecError(f"cannot encode: {e}")
+
+    def encode_batch(self, packets):  # packets already encoded by this codec, embedded as they are
+        buf = bytearray((GENERIC, T_DICT, 2))
+        for symbol in ('type', 'batch', 'packets'):
+            buf += bytes((T_SYMBOL, self._symbol_ids[symbol]))
+
+        buf.append(T_LIST)
+        write_varint(buf, len(packets))
+        for data in packets:
+            buf.append(T_PACKET)
+            write_varint(buf, len(data))
+            buf += data
+
+        return bytes(buf)
+
+    def _encode_schema(self, sid, packet):
+        head, lengths = self._heads[sid]
+
+        values = list()
+        sizes = list()
+
+        for field in schemas[sid][1]:
+            value = packet[field]
+
+            if value is None:
+                sizes.append(NULL)
+                continue
+
+            if type(value) is not str:
+                return None
+
+            value = value.encode('utf8')
+            if len(value) >= NULL:
+                return None
+
+            values.append(value)
+            sizes.append(len(value))
+
+        return head + lengths.pack(*sizes) + b''.join(values)
+
+    def decode(self, data):
+        try:
+            sid = data[0]
+
+            if sid == GENERIC_JSON:
+                return json.loads(data[1:].decode('utf8'))
+
+            if sid == GENERIC:
+                value, pos = self._decode_value(memoryview(data), 1)
+                if pos != len(data):
+                    raise CodecError("trailing data")
+                return value
+
+            ptype, fields = schemas[sid]
+            head, lengths = self._heads[sid]
+
+            packet = {'type': ptype}
+            pos = 1 + lengths.size
+
+            for field, size in zip(fields, lengths.unpack_from(data, 1)):
+                if size == NULL:
+                    packet[field] = None
+                else:
+                    packet[field] = data[pos:pos + size].decode('utf8')
+                    pos += size
+
+            if pos != len(data):
+                raise CodecError("packet size mismatch")
+
+            return packet
+        except (IndexError, KeyError, struct.error, UnicodeDecodeError, RecursionError, ValueError) as e:
+            raise CodecError(f"bad binary packet: {e}")
+
+    def _decode_value(self, view, pos):
+        tag = view[pos]
+        pos += 1
+
+        if tag == T_NONE:
+            return None, pos
+        elif tag == T_TRUE:
+            return True, pos
+        elif tag == T_FALSE:
+            return False, pos
+        elif tag == T_INT:
+            value, pos = read_varint(view, pos)
+            return (value >> 1) ^ -(value & 1), pos
+        elif tag == T_FLOAT:
+            return float_fmt.unpack_from(view, pos)[0], pos + float_fmt.size
+        elif tag == T_SYMBOL:
+            return symbols[view[pos]], pos + 1
+        elif tag == T_STR:
+            size, pos = read_varint(view, pos)
+            if pos + size > len(view):
+                raise CodecError("truncated string")
+            return str(view[pos:pos + size], 'utf8'), pos + size
+        elif tag == T_LIST:
+            count, pos = read_varint(view, pos)
+            items = list()
+            for _ in range(count):
+                item, pos = self._decode_value(view, pos)
+                items.append(item)
+            return items, pos
+        elif tag == T_DICT:
+            count, pos = read_varint(view, pos)
+            items = dict()
+            for _ in range(count):
+                key, pos = self._decode_value(view, pos)
+                items[key], pos = self._decode_value(view, pos)
+            return items, pos
+        elif tag == T_PACKET:
+            size, pos = read_varint(view, pos)
+            if pos + size > len(view):
+                raise CodecError("truncated packet")
+            return self.decode(bytes(view[pos:pos + size])), pos + size
+
+        raise CodecError(f"unknown tag {tag}")
+
+
+def write_varint(buf, value):
+    while value > 0x7F:
+        buf.append(value & 0x7F | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(view, pos):
+    value = 0
+    shift = 0
+
+    while True:
+        byte = view[pos]
+        pos += 1
+
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+
+        shift += 7
+
+
+json_codec = JsonCodec()
+binary_codec = BinaryCodec()
+
+available_codecs = {codec.name: codec for codec in (binary_codec, json_codec)}  # by preference
+
+
+def get_codec(name):
+    return available_codecs.get(name, json_codec)
+
+
+def choose_codec(names):
+    for name in available_codecs:
+        if name in names:
+            return available_codecs[name]
+    return json_codec
+
+
+def decode_packet(data):
+    if data and data[0] >= 0x80:
+        return binary_codec.decode(data)
+    return json_codec.decode(data)
@@ -0,0 +1,107 @@
+from .const import MAX_FRAME_SIZE, MAX_MESSAGE_SIZE, COMPRESS_THRESHOLD
+from .framing import FrameError, FLAG_COMPRESSED, header, pack_frame, pack_fragments
+from time import perf_counter
+import zlib
+
+DEFLATE = "deflate"
+
+# Seeds every deflate stream, so even the first frames of a connection compress well
+ZDICT = (
+    b'"channel": null}{"type": "authresp", "success": true, "username": '
+    b'{"type": "channel_set", "channel": {"type": "channel_remove", "channel": '
+    b' +orangered(left) +green(joined) +green(changed his name to '
+    b'+orangered(You are muted!)+orangered(Reason: +yellow(Server)'
+    b'{"type": "server_message", "text": "channel": "__global__"}'
+    b'{"type": "message", "text": "user": "'
+)
+
+SYNC_TAIL = b'\x00\x00\xff\xff'  # every Z_SYNC_FLUSH block ends with it, so it is not sent
+STREAM_LIMIT = MAX_FRAME_SIZE - 64  # deflate may grow incompressible data a little
+
+
+class CompressionStats:
+    def __init__(self):
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    def add(self, size_in, size_out, cpu_time):
+        self.frames += 1
+        self.bytes_in += size_in
+        self.bytes_out += size_out
+        self.cpu_time += cpu_time
+
+    def get(self, prefix):
+        return {
+            f'{prefix}_frames': self.frames,
+            f'{prefix}_bytes_in': self.bytes_in,
+            f'{prefix}_bytes_out': self.bytes_out,
+            f'{prefix}_cpu_ms': round(self.cpu_time * 1000, 1)
+        }
+
+
+class FrameCompressor:
+    def __init__(self, stats, threshold=COMPRESS_THRESHOLD, level=6):
+        self.stats = stats
+        self.threshold = threshold
+        self.level = level
+
+        self._stream = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=ZDICT)
+
+    def pack(self, data):
+        if len(data) < self.threshold or len(data) > STREAM_LIMIT:
+            return pack_frame(data)
+
+        t = perf_counter()
+        cdata = self._stream.compress(data) + self._stream.flush(zlib.Z_SYNC_FLUSH)
+        cdata = cdata[:-len(SYNC_TAIL)]
+        self.stats.add(len(data), len(cdata), perf_counter() - t)
+
+        return header.pack(FLAG_COMPRESSED | len(cdata)) + cdata
+
+    def pack_fragments(self, data):  # fragments may be reordered with small frames, so they get their own stream
+        t = perf_counter()
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=ZDICT)
+        cdata = compressor.compress(data) + compressor.flush()
+        self.stats.add(len(data), len(cdata), perf_counter() - t)
+
+        return pack_fragments(cdata, FLAG_COMPRESSED)
+
+
+class FrameDecompressor:
+    def __init__(self, stats, max_frame=MAX_FRAME_SIZE, max_message=MAX_MESSAGE_SIZE):
+        self.stats = stats
+        self.max_frame = max_frame
+        self.max_message = max_message
+
+        self._stream = zlib.decompressobj(-15, zdict=ZDICT)
+
+    def frame(self, cdata):
+        t = perf_counter()
+
+        try:
+            data = self._stream.decompress(cdata + SYNC_TAIL, self.max_frame + 1)
+        except zlib.error as e:
+            raise FrameError(f"bad compressed frame: {e}")
+
+        if len(data) > self.max_frame:
+            raise FrameError(f"decompressed frame size > {self.max_frame}")
+
+        self.stats.add(len(cdata), len(data), perf_counter() - t)
+        return data
+
+    def message(self, cdata):
+        t = perf_counter()
+        decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+
+        try:
+            data = decompressor.decompress(cdata, self.max_message + 1)
+        except zlib.error as e:
+            raise FrameError(f"bad compressed message: {e}")
+
+        if len(data) > self.max_message:
+            raise FrameError(f"decompressed message size > {self.max_message}")
+
+        self.stats.add(len(cdata), len(data), perf_counter() - t)
+        return data
@@ -1,14 +1,33 @@
-import netifaces
+from .interface import get_local_ip, get_mask, get_broadcast_addr, get_interface
 
 PACKET_SIZE = 1400
 DATAGRAM_SIZE = 256
 
+MAX_FRAME_SIZE = PACKET_SIZE - 4
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024  # messages above MAX_FRAME_SIZE are sent as fragments
+
+COMPRESS_THRESHOLD = 32  # smaller frames are sent uncompressed
+
+WRITE_HIGH_WATERMARK = 256 * 1024
+WRITE_LOW_WATERMARK = 64 * 1024
+
+GATHER_FRAMES = 64  # frames written with one sendmsg call
+GATHER_BYTES = 64 * 1024
+
+DISPATCH_BUDGET = 256  # events handled per event thread wakeup
+
 PORT = 6489
 UDP_PORT = 57803
 
-INTERFACE = netifaces.gateways()['default'][netifaces.AF_INET][1]
-netinfo = netifaces.ifaddresses(INTERFACE)[netifaces.AF_INET][0]
+address_getters = {
+    'LOCAL_IP': get_local_ip,
+    'MASK': get_mask,
+    'BROADCAST_ADDR': get_broadcast_addr,
+    'INTERFACE': get_interface
+}
+
 
-LOCAL_IP = netinfo['addr']
-MASK = netinfo['netmask']
-BROADCAST_ADDR = netinfo['broadcast']
+def __getattr__(name):  # the addresses are looked up on first use, not on import
+    if name in address_getters:
+        return address_getters[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,77 @@
+from .const import DISPATCH_BUDGET
+from queue import Empty
+import time
+
+
+class DispatchStats:
+    def __init__(self):
+        self.counts = dict()  # event type -> events handled
+        self.times = dict()  # event type -> seconds spent in the handler
+        self.batches = 0
+        self.events = 0
+
+    def add(self, event_type, elapsed):
+        self.counts[event_type] = self.counts.get(event_type, 0) + 1
+        self.times[event_type] = self.times.get(event_type, 0) + elapsed
+
+    def get(self):
+        stats = {
+            'batches': self.batches,
+            'events_per_batch': round(self.events / self.batches, 2) if self.batches else 0
+        }
+
+        for event_type, count in sorted(self.counts.items()):
+            total = self.times[event_type]
+            stats[f"{event_type}_count"] = count
+            stats[f"{event_type}_ms"] = round(total * 1000, 1)
+            stats[f"{event_type}_avg_us"] = round(total / count * 1e6, 1)
+
+        return stats
+
+
+class EventDispatcher:
+    def __init__(self, queue, handlers, budget=DISPATCH_BUDGET, before=None, after=None):
+        self.queue = queue
+        self.handlers = handlers  # event type -> handler(*event[1:])
+        self.budget = budget  # events handled per wakeup
+
+        self.before = before  # called before and after every batch of events
+        self.after = after
+
+        self.stats = DispatchStats()
+
+    def run(self):  # until 'exit' is queued
+        queue = self.queue
+
+        while True:
+            batch = [queue.get()]
+
+            try:
+                while len(batch) < self.budget:
+                    batch.append(queue.get_nowait())
+            except Empty:
+                pass
+
+            if self.before:
+                self.before()
+
+            try:
+                for event in batch:
+                    if event == 'exit':
+                        return
+                    self.dispatch(event)
+            finally:
+                if self.after:
+                    self.after()
+
+                self.stats.batches += 1
+                self.stats.events += len(batch)
+
+    def dispatch(self, event):
+        event_type = event[0]
+        handler = self.handlers.get(event_type)
+
+        start = time.perf_counter()
+        if handler:
+            handler(*event[1:])
+        self.stats.add(event_type, time.perf_counter() - start)
@@ -0,0 +1,123 @@
+from .const import PACKET_SIZE, MAX_FRAME_SIZE, MAX_MESSAGE_SIZE
+import struct
+
+header = struct.Struct(">I")
+
+FLAG_FRAGMENT = 0x80000000  # frame is a part of a message larger than MAX_FRAME_SIZE
+FLAG_END = 0x40000000  # last fragment of the message
+FLAG_COMPRESSED = 0x20000000  # payload is deflated, see compression.py
+LENGTH_MASK = 0x1FFFFFFF
+
+
+class FrameError(Exception):
+    pass
+
+
+def pack_frame(data):
+    return header.pack(len(data)) + data
+
+
+def pack_fragments(data, flags=0, size=MAX_FRAME_SIZE):
+    view = memoryview(data)
+    fragments = list()
+
+    for s in range(0, len(view), size):
+        chunk = view[s:s + size]
+        fflags = flags | FLAG_FRAGMENT
+        if s + size >= len(view):
+            fflags |= FLAG_END
+
+        fragments.append(header.pack(fflags | len(chunk)) + chunk)
+
+    return fragments
+
+
+class FrameDecoder:
+    def __init__(self, max_frame=MAX_FRAME_SIZE, max_message=MAX_MESSAGE_SIZE, bufsize=PACKET_SIZE * 4,
+                 decompressor=None):
+        self.max_frame = max_frame
+        self.max_message = max_message
+        self.decompressor = decompressor
+
+        # a partial frame always fits after compaction, so the buffer never grows
+        self._buf = bytearray(max(bufsize, max_frame + header.size))
+        self._view = memoryview(self._buf)
+
+        self._start = 0  # first unread byte
+        self._end = 0  # end of received data
+
+        self._message = bytearray()  # fragments received so far
+
+    def recv_into(self, sock):
+        n = sock.recv_into(self.get_buffer())
+        self._end += n
+        return n
+
+    def get_buffer(self):  # free space for the next read, see advance()
+        if self._end == len(self._buf):
+            self._compact()
+
+        return self._view[self._end:]
+
+    def advance(self, n):
+        self._end += n
+
+    def feed(self, data):
+        data = memoryview(data)
+
+        while data:
+            if self._end == len(self._buf):
+                self._compact()
+
+            n = min(len(data), len(self._buf) - self._end)
+            self._view[self._end:self._end + n] = data[:n]
+            self._end += n
+            data = data[n:]
+
+            yield from self.frames()
+
+    def frames(self):
+        while self._end - self._start >= header.size:
+            word = header.unpack_from(self._buf, self._start)[0]
+            size = word & LENGTH_MASK
+
+            if size > self.max_frame:
+                raise FrameError(f"frame size {size} > {self.max_frame}")
+
+            s = self._start + header.size
+            if self._end - s < size:
+                break
+
+            self._start = s + size
+
+            if word & FLAG_COMPRESSED and not self.decompressor:
+                raise FrameError("compressed frame without decompressor")
+
+            if word & FLAG_FRAGMENT:
+                if len(self._message) + size > self.max_message:
+                    self._message = bytearray()
+                    raise FrameError(f"message size > {self.max_message}")
+
+                self._message += self._view[s:s + size]
+
+                if word & FLAG_END:
+                    message, self._message = bytes(self._message), bytearray()
+
+                    if word & FLAG_COMPRESSED:
+                        message = self.decompressor.message(message)
+
+                    yield message
+            elif word & FLAG_COMPRESSED:
+                yield self.decompressor.frame(bytes(self._view[s:s + size]))
+            else:
+                yield bytes(self._view[s:s + size])
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _compact(self):
+        pending = self._end - self._start
+
+        self._buf[:pending] = self._buf[self._start:self._end]
+        self._start = 0
+        self._end = pending
@@ -0,0 +1,53 @@
+import os
+
+FALLBACK_LOCAL_IP = "0.0.0.0"  # every interface, when there is no default route
+FALLBACK_MASK = "0.0.0.0"
+FALLBACK_BROADCAST_ADDR = "255.255.255.255"
+
+_overrides = dict()  # set_addresses() and the TINYCHAT_* environment variables win over the interface
+_detected = None
+
+
+def set_addresses(local_ip=None, broadcast_addr=None, mask=None):
+    for key, value in (('addr', local_ip), ('broadcast', broadcast_addr), ('netmask', mask)):
+        if value:
+            _overrides[key] = value
+
+
+def detect_interface():  # -> (interface name, addresses of the default route interface), resolved once
+    global _detected
+
+    if _detected is None:
+        try:
+            import netifaces
+
+            interface = netifaces.gateways()['default'][netifaces.AF_INET][1]
+            _detected = interface, netifaces.ifaddresses(interface)[netifaces.AF_INET][0]
+        except (ImportError, KeyError, IndexError, ValueError, OSError):
+            _detected = None, dict()
+
+    return _detected
+
+
+def _get(key, env, fallback):
+    value = _overrides.get(key) or os.environ.get(env)
+    if value:
+        return value
+
+    return detect_interface()[1].get(key) or fallback
+
+
+def get_local_ip():
+    return _get('addr', "TINYCHAT_LOCAL_IP", FALLBACK_LOCAL_IP)
+
+
+def get_broadcast_addr():
+    return _get('broadcast', "TINYCHAT_BROADCAST_ADDR", FALLBACK_BROADCAST_ADDR)
+
+
+def get_mask():
+    return _get('netmask', "TINYCHAT_MASK", FALLBACK_MASK)
+
+
+def get_interface():
+    return detect_interface()[0]
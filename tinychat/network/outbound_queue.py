@@ -0,0 +1,167 @@
+from .const import WRITE_HIGH_WATERMARK, WRITE_LOW_WATERMARK, GATHER_FRAMES, GATHER_BYTES
+from .framing import header, pack_frame
+from collections import deque
+from threading import Lock
+
+
+class WriteStats:
+    def __init__(self):
+        self.syscalls = 0
+        self.frames = 0
+        self.bytes = 0
+
+    def get(self):
+        return {
+            'write_syscalls': self.syscalls,
+            'frames_sent': self.frames,
+            'bytes_sent': self.bytes,
+            'frames_per_syscall': round(self.frames / self.syscalls, 2) if self.syscalls else 0
+        }
+
+
+class OutboundQueue:
+    def __init__(self, high_watermark=WRITE_HIGH_WATERMARK, low_watermark=WRITE_LOW_WATERMARK, stats=None):
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.stats = stats or WriteStats()
+
+        self.lock = Lock()
+
+        # frames are packed only when they are written: dropped frames never touch the compression stream
+        self.pack = pack_frame
+
+        self.frames = deque()
+        self.bulk = deque()  # packed fragments of large messages, sent between small frames
+        self.ready = deque()  # packed frames gathered for the next write, the first one may be partly written
+        self.bytes = 0
+
+        self.over_budget = False
+
+    def __len__(self):
+        return len(self.frames) + len(self.bulk) + len(self.ready)
+
+    def push(self, data, droppable=False):
+        self.frames.append((data, droppable))
+        self.bytes += len(data) + header.size
+
+        return self._update()
+
+    def push_bulk(self, fragments):
+        for fragment in fragments:
+            self.bulk.append(fragment)
+            self.bytes += len(fragment)
+
+        return self._update()
+
+    def drop_oldest(self, limit):  # drops droppable frames until bytes <= limit
+        frames = self.frames
+        kept = deque()
+        dropped = 0
+
+        while frames and self.bytes > limit:
+            data, droppable = frames.popleft()
+
+            if droppable:
+                self.bytes -= len(data) + header.size
+                dropped += 1
+            else:
+                kept.append((data, droppable))
+
+        kept.extend(frames)
+        self.frames = kept
+
+        self._update()
+        return dropped
+
+    def _gather(self):
+        ready = self.ready
+        size = sum(len(frame) for frame in ready)
+
+        while len(ready) < GATHER_FRAMES and size < GATHER_BYTES:
+            if self.frames:  # small frames go first, fragments fill the rest of the write
+                data, _ = self.frames.popleft()
+                frame = self.pack(data)
+                self.bytes += len(frame) - len(data) - header.size
+            elif self.bulk:
+                frame = self.bulk.popleft()
+            else:
+                break
+
+            ready.append(memoryview(frame))
+            size += len(frame)
+
+    def send(self, sock):
+        ready = self.ready
+        stats = self.stats
+
+        while True:
+            self._gather()
+
+            if not ready:
+                break
+
+            try:
+                if len(ready) == 1:
+                    n = sock.send(ready[0])
+                elif hasattr(sock, 'sendmsg'):
+                    n = sock.sendmsg(ready)
+                else:
+                    n = sock.send(b''.join(ready))
+            except (BlockingIOError, InterruptedError):
+                break
+
+            stats.syscalls += 1
+            stats.bytes += n
+            self.bytes -= n
+
+            while n:
+                head = ready[0]
+
+                if n < len(head):
+                    ready[0] = head[n:]
+                    break
+
+                n -= len(head)
+                ready.popleft()
+                stats.frames += 1
+
+            if ready:
+                break  # socket buffer is full
+
+        return self._update()
+
+    def take(self):  # gathered frames for a transport that does its own writing
+        self._gather()
+
+        frames = list(self.ready)
+        self.ready.clear()
+
+        if frames:
+            size = sum(len(frame) for frame in frames)
+
+            self.stats.syscalls += 1
+            self.stats.frames += len(frames)
+            self.stats.bytes += size
+            self.bytes -= size
+
+        self._update()
+        return frames
+
+    def clear(self):
+        self.frames.clear()
+        self.bulk.clear()
+        self.ready.clear()
+        self.bytes = 0
+
+        return self._update()
+
+    def _update(self):  # returns True when the queue crossed a watermark
+        if not self.over_budget and self.bytes > self.high_watermark:
+            self.over_budget = True
+            return True
+
+        if self.over_budget and self.bytes <= self.low_watermark:
+            self.over_budget = False
+            return True
+
+        return False
@@ -1,21 +1,66 @@
-from .const import PACKET_SIZE, LOCAL_IP
+from .const import MAX_FRAME_SIZE, MAX_MESSAGE_SIZE, WRITE_HIGH_WATERMARK, WRITE_LOW_WATERMARK
+from .interface import get_local_ip
+from .framing import FrameDecoder, FrameError, pack_fragments
+from .outbound_queue import OutboundQueue, WriteStats
+from .compression import CompressionStats, FrameCompressor, FrameDecompressor
 from socket import *
-from select import select
-from threading import Thread
-import struct
+from threading import Thread, Lock
+import selectors
+import time
+
+
+class Connection:
+    def __init__(self, sock, addr, high_watermark, low_watermark, policy, write_stats, decompress_stats):
+        self.socket = sock
+        self.addr = addr
+
+        self.decoder = FrameDecoder(decompressor=FrameDecompressor(decompress_stats))
+        self.outbound = OutboundQueue(high_watermark, low_watermark, write_stats)
+        self.compressor = None  # set when the peer agreed on compression
+
+        self.writing = False  # EVENT_WRITE is registered
+
+        self.policy = policy
+        self.over_since = None
+        self.skipped = 0
+
+    def pack_fragments(self, data):
+        if self.compressor:
+            return self.compressor.pack_fragments(data)
+        return pack_fragments(data)
 
 
 class ServerSocket:
-    def __init__(self, port, queue, exception_handler):
+    def __init__(self, port, queue, exception_handler,
+                 high_watermark=WRITE_HIGH_WATERMARK, low_watermark=WRITE_LOW_WATERMARK, policy=None, reuse_port=False):
         self.PORT = port
+        self.reuse_port = reuse_port  # several processes accept on the same port
 
         self.queue = queue
         self.exception = exception_handler
 
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy  # slow consumer policy for new connections
+
+        self.write_stats = WriteStats()
+        self.compress_stats = CompressionStats()
+        self.decompress_stats = CompressionStats()
+
         self.addr = None
         self._socket = None
 
-        self.clients = list()
+        self.clients = dict()  # socket -> Connection
+        self._selector = None
+
+        self._wakeup_r = None
+        self._wakeup_w = None
+
+        self._lock = Lock()
+        self._closing = list()
+        self._dirty = set()  # connections with frames queued since the last flush
+        self._corked = 0
+        self._lagging = set()
 
         self._running = False
         self._socket_thread = None
@@ -24,94 +69,324 @@ class ServerSocket:
         self._socket = socket(AF_INET, SOCK_STREAM)
         self._socket.setblocking(False)
         self._socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # add reuseaddr socket option
+        if self.reuse_port:
+            self._socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
 
-        self.addr = (LOCAL_IP, self.PORT)
+        self.addr = (get_local_ip(), self.PORT)
 
         try:
             self._socket.bind(self.addr)
             self._socket.listen()
-            self.clients.append(self._socket)
-            self.queue.put(("server_start", None))
+            self._post(("server_start", None))
         except error as e:
-            self.queue.put(("server_start", e))
+            self._post(("server_start", e))
             return
 
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._socket, selectors.EVENT_READ)
+
+        # close() and kick() wake the loop through this pair instead of closing fds under select
+        self._wakeup_r, self._wakeup_w = socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+
         self._running = True
         self._socket_thread = Thread(target=self._threadmain)
         self._socket_thread.start()
 
     def _threadmain(self):
         while self._running:
-            rd, wt, exc = select(self.clients, [], [])
-
-            if rd:
-                for s in rd:
-                    if s is self._socket:
-                        if s.fileno() == -1:
-                            break
-
-                        client, addr = s.accept()
-                        self.clients.append(client)
-                        self.queue.put(("connection_request", client, addr))
-                    else:
-                        if s.fileno() == -1:
-                            self.clients.remove(s)
-                            continue
-
-                        try:
-                            data = s.recv(PACKET_SIZE)
-                        except ConnectionResetError:
-                            self.queue.put(("disconnected", s.getpeername()))
-                            self.clients.remove(s)
-                            continue
-
-                        if not data:
-                            self.queue.put(("disconnected", s.getpeername()))
-                            self.clients.remove(s)
-                            continue
-
-                        self.receive(s, data)
-
-    def send(self, s, data):
-        try:
-            size = len(data)
+            events = self._selector.select(1 if self._lagging else None)
 
-            if size > PACKET_SIZE - 4:
-                self.exception("data len > packet size")
-                return False
+            for key, mask in events:
+                s = key.fileobj
 
-            size_b = struct.pack(">I", size)
-            s.send(size_b + data)
+                if s is self._wakeup_r:
+                    self._drain_wakeup()
+                elif s is self._socket:
+                    self._accept()
+                else:
+                    if mask & selectors.EVENT_WRITE:
+                        self._write(key.data)
+                    if mask & selectors.EVENT_READ:
+                        self._read(key.data)
 
-            return True
+            self._close_pending()
+            self._flush_dirty()
+            self._check_lagging()
+
+        self._shutdown()
+
+    def _accept(self):
+        try:
+            client, addr = self._socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
         except error as e:
             self.exception(e)
-            return False
+            return
 
-    def receive(self, sock, rc):
+        client.setblocking(False)
+
+        conn = Connection(client, addr, self.high_watermark, self.low_watermark, self.policy,
+                          self.write_stats, self.decompress_stats)
+        self.clients[client] = conn
+        self._selector.register(client, selectors.EVENT_READ, conn)
+        self._post(("connection_request", client, addr))
+
+    def _read(self, conn):
         try:
-            data = rc
-            while data:
-                size = struct.unpack(">I", data[:4])[0]
+            n = conn.decoder.recv_into(conn.socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except error:
+            n = 0
+
+        if not n:
+            self._drop(conn.socket)
+            return
+
+        self.receive(conn.socket, conn.decoder)
 
-                pdata = data[4:size + 4]
-                data = data[size + 4:]
+    def _write(self, conn):
+        outbound = conn.outbound
+
+        try:
+            with outbound.lock:
+                was_over = outbound.over_budget
+                outbound.send(conn.socket)
+
+                if was_over and not outbound.over_budget:
+                    self._recovered(conn)
+
+                done = not outbound
+        except error:
+            self._drop(conn.socket)
+            return
+
+        if was_over != outbound.over_budget:
+            self._post(("backpressure", conn.socket, conn.addr, outbound.over_budget))
+
+        if done and conn.writing:
+            conn.writing = False
+            self._selector.modify(conn.socket, selectors.EVENT_READ, conn)
+
+    def _flush_dirty(self):  # all frames queued for a connection during a tick go out together
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+        for conn in dirty:
+            if conn.writing or conn.socket not in self.clients:
+                continue  # EVENT_WRITE will flush it
+
+            self._write(conn)
+
+            if conn.outbound and conn.socket in self.clients:
+                conn.writing = True
+                self._selector.modify(conn.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+
+    def _drop(self, s):
+        conn = self.clients.pop(s, None)
+        if conn is None:
+            return
+
+        self._selector.unregister(s)
+        s.close()
+
+        with conn.outbound.lock:
+            conn.outbound.clear()
+
+        with self._lock:
+            self._lagging.discard(conn)
+
+        self._post(("disconnected", conn.addr))
+
+    def post(self, event):  # an event from another source, e.g. the shard bus
+        self._post(event)
+
+    def _post(self, event):
+        self.queue.put(event)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(512):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass  # loop is already woken up
+        except (AttributeError, OSError):
+            pass  # socket is not opened
 
-                self.queue.put(("packet", sock, sock.getpeername(), pdata))
+    def _close_pending(self):
+        with self._lock:
+            closing, self._closing = self._closing, list()
 
-        except struct.error as e:
+        for s in closing:
+            conn = self.clients.get(s)
+            if conn and conn.outbound:
+                self._write(conn)  # best effort, so the kick reason reaches the client
+
+            self._drop(s)
+
+    def _shutdown(self):
+        for s in list(self.clients):
+            self._selector.unregister(s)
+            s.close()
+        self.clients.clear()
+
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def _overflowed(self, conn):  # called under the queue lock
+        conn.over_since = time.monotonic()
+
+        with self._lock:
+            self._lagging.add(conn)
+
+    def _recovered(self, conn):  # called under the queue lock
+        conn.over_since = None
+
+        with self._lock:
+            self._lagging.discard(conn)
+
+        if conn.policy:
+            conn.policy.recover(conn)
+
+    def _check_lagging(self):
+        now = time.monotonic()
+
+        with self._lock:
+            lagging = list(self._lagging)
+
+        for conn in lagging:
+            if conn.policy and conn.over_since is not None and conn.policy.expired(conn, now):
+                self._drop(conn.socket)
+
+    def send(self, s, data, droppable=False):
+        size = len(data)
+
+        if size > MAX_MESSAGE_SIZE:
+            self.exception("data len > max message size")
+            return False
+
+        conn = self.clients.get(s)
+        if not conn:
+            return False
+
+        outbound = conn.outbound
+
+        with outbound.lock:
+            was_over = outbound.over_budget
+
+            if size > MAX_FRAME_SIZE:
+                outbound.push_bulk(conn.pack_fragments(data))
+            else:
+                outbound.push(data, droppable)
+
+            if outbound.bytes > outbound.high_watermark and conn.policy:
+                conn.policy.overflow(conn)
+
+            if not was_over and outbound.over_budget:
+                self._overflowed(conn)
+            elif was_over and not outbound.over_budget:
+                self._recovered(conn)
+
+        with self._lock:
+            wakeup = not self._dirty and not self._corked
+            self._dirty.add(conn)
+
+        if was_over != outbound.over_budget:
+            self._post(("backpressure", s, conn.addr, outbound.over_budget))
+            wakeup = True  # select timeout depends on lagging connections
+
+        if wakeup:
+            self._wakeup()
+
+        return True
+
+    def cork(self):  # sends are only queued until uncork(), so one tick of events is flushed at once
+        with self._lock:
+            self._corked += 1
+
+    def uncork(self):
+        with self._lock:
+            self._corked -= 1
+            wakeup = not self._corked and self._dirty
+
+        if wakeup:
+            self._wakeup()
+
+    def over_budget(self, s):
+        conn = self.clients.get(s)
+        return conn is not None and conn.outbound.over_budget
+
+    def set_policy(self, policy, s=None):
+        if s is None:
+            self.policy = policy
+            return
+
+        conn = self.clients.get(s)
+        if conn:
+            conn.policy = policy
+
+    def set_compression(self, s, enabled):  # agreed once, the peer's deflate window lives as long as the connection
+        conn = self.clients.get(s)
+        if not conn or conn.compressor or not enabled:
+            return
+
+        with conn.outbound.lock:
+            conn.compressor = FrameCompressor(self.compress_stats)
+            conn.outbound.pack = conn.compressor.pack
+
+    def stats(self):
+        stats = {
+            'connections': len(self.clients),
+            'lagging': len(self._lagging),
+            'queued_bytes': sum(conn.outbound.bytes for conn in list(self.clients.values())),
+            'queued_frames': sum(len(conn.outbound) for conn in list(self.clients.values()))
+        }
+
+        if self.policy:
+            stats.update(self.policy.get_counters())
+
+        stats.update(self.write_stats.get())
+        stats.update(self.compress_stats.get('compress'))
+        stats.update(self.decompress_stats.get('decompress'))
+
+        return stats
+
+    def receive(self, sock, decoder):
+        conn = self.clients[sock]
+
+        try:
+            for pdata in decoder.frames():
+                self._post(("packet", sock, conn.addr, pdata))
+
+        except FrameError as e:
             self.exception(e)
+            self._drop(sock)
 
     def kick(self, s):
-        self.queue.put(("disconnected", s.getpeername()))
-        s.close()
+        with self._lock:
+            self._closing.append(s)
+        self._wakeup()
 
     def close(self):
         self._running = False
 
         if self._socket:
-            self._socket.close()
+            self._wakeup()
 
         if self._socket_thread:
             self._socket_thread.join()
             self._socket_thread = None
+
+        if self._socket:
+            self._socket.close()
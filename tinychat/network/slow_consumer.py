@@ -0,0 +1,76 @@
+class SlowConsumerPolicy:
+    counter_names = ()
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.counter_names, 0)
+
+    def overflow(self, conn):  # queue is above the high watermark, called under the queue lock
+        pass
+
+    def recover(self, conn):  # queue went under the low watermark, called under the queue lock
+        pass
+
+    def expired(self, conn, now):  # return True to kick the connection
+        return False
+
+    def get_counters(self):
+        return dict(self.counters)
+
+
+class DropOldestPolicy(SlowConsumerPolicy):
+    counter_names = ("drops", "frames_dropped")
+
+    def overflow(self, conn):
+        outbound = conn.outbound
+        dropped = outbound.drop_oldest(outbound.high_watermark)
+
+        if dropped:
+            conn.skipped += dropped
+
+            self.counters["drops"] += 1
+            self.counters["frames_dropped"] += dropped
+
+
+class SummarizePolicy(DropOldestPolicy):
+    counter_names = ("drops", "frames_dropped", "summaries_sent")
+
+    def __init__(self, summary):
+        DropOldestPolicy.__init__(self)
+        self.summary = summary  # (socket, count) -> packet data
+
+    def recover(self, conn):
+        if conn.skipped:
+            conn.outbound.push(self.summary(conn.socket, conn.skipped))
+            conn.skipped = 0
+
+            self.counters["summaries_sent"] += 1
+
+
+class DisconnectPolicy(SlowConsumerPolicy):
+    counter_names = ("kicks",)
+
+    def __init__(self, timeout, policy=None):
+        SlowConsumerPolicy.__init__(self)
+        self.timeout = timeout
+        self.policy = policy  # applied until the connection is kicked
+
+    def overflow(self, conn):
+        if self.policy:
+            self.policy.overflow(conn)
+
+    def recover(self, conn):
+        if self.policy:
+            self.policy.recover(conn)
+
+    def expired(self, conn, now):
+        if now - conn.over_since < self.timeout:
+            return False
+
+        self.counters["kicks"] += 1
+        return True
+
+    def get_counters(self):
+        counters = dict(self.counters)
+        if self.policy:
+            counters.update(self.policy.get_counters())
+        return counters
@@ -1 +1,12 @@
 from .server import Server
+from .shard_bus import ShardBus
+from .cluster_bus import ClusterBus
+from .history_store import HistoryStore
+from .log_ui import NullUi, LogUi, start_logging
+
+
+def __getattr__(name):  # sqlite3 is imported only by the servers that keep their users
+    if name == "UserStore":
+        from .user_store import UserStore
+        return UserStore
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
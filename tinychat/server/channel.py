@@ -1,53 +1,70 @@
 from collections import namedtuple
 from .commands import Commands
-import json
+from .history import MessageHistory
+from .search import SearchIndex
 
 channel_user = namedtuple("channel_user", ("uconn", "user", "channels", "channel_rights"))
 
+droppable_packets = ('message', 'server_message')  # slow consumers may lose these, never control packets
+
+PERM_WRITE = 1
+PERM_ADMIN = 2
+
 
 class Channel:
-    def __init__(self, server, name, admin):
+    def __init__(self, server, name, admin, shard=None):
         self.server = server
         self.userlist = server.userlist
         self.channels = server.channels
 
         self.name = name
         self.admin_user = admin
-        self.second_admins = list()
+        self.shard = shard  # worker or node that owns the channel, None if it is created here
+        self.second_admins = set()  # users
 
         self.userlimit = -1
 
         self.hidden = False
 
-        self.users = list()
+        self.users = dict()  # user -> channel user
 
         self.whitelist_enabled = False
-        self.whitelist = list()
-        self.blacklist = list()
+        self.whitelist = set()  # users
+        self.blacklist = set()
 
         self.write_right = None
+        self.permissions = dict()  # user -> PERM_* bitmask, dropped when the rights or admins of the user change
 
-        self.message_log = list()
+        self.history = MessageHistory(server.history_messages, server.history_bytes)  # replayed to joining users
+        self.search = SearchIndex(server.search_messages, server.search_bytes)
 
     def get_connections(self):
-        return [user.uconn for user in self.users]
+        return [c_user.uconn for c_user in self.users.values()]
 
     def find_user(self, user):
-        for c_user in self.users:
-            if c_user.user == user:
-                return c_user
-        return None
+        return self.users.get(user)
 
     def find_user_by_name(self, uname):
-        for c_user in self.users:
-            if c_user.user.username_p == uname:
-                return c_user
-        return None
+        return self.users.get(self.userlist.find_by_name(uname))
+
+    def is_admin(self, c_user):
+        return c_user == self.admin_user or c_user not in ("Server", None) and c_user.user in self.second_admins
+
+    def get_permissions(self, c_user):
+        perms = self.permissions.get(c_user.user)
+
+        if perms is None:
+            perms = 0
+            if self.is_admin(c_user):
+                perms |= PERM_ADMIN | PERM_WRITE
+            elif not self.write_right or self.write_right in c_user.channel_rights[self.name]:
+                perms |= PERM_WRITE
+
+            self.permissions[c_user.user] = perms
+        return perms
 
     def send_packet(self, user, packet):
-        db = json.dumps(packet).encode('utf8')
-        socket = self.server.socket
-        socket.send(user.uconn.socket, db)
+        self.server.send_packet(user.uconn.socket, packet)
 
     def send_servermsg(self, user, msg, channel_data=False):
         if user == "Server":
@@ -68,17 +85,24 @@ class Channel:
                 }
                 self.send_packet(user, packet)
 
-    def broadcast_packet(self, packet, excepted=None):
-        db = json.dumps(packet).encode('utf8')
-        socket = self.server.socket
+    def broadcast_packet(self, packet, excepted=None, relay=True):
+        if relay and self.server.bus:  # users of the channel on other workers
+            self.server.bus.publish({'type': 'broadcast', 'channel': self.name, 'packet': packet})
+
+        if packet['type'] == 'message':
+            self.history.append(packet)
+            self.search.add(packet['user'], packet['text'])
+            if self.server.store and self.shard is None:
+                self.server.store.append(self.name, packet)
+
+        droppable = packet['type'] in droppable_packets
 
         if excepted:
-            for usock, _, user in self.get_connections():
-                if user not in excepted:
-                    socket.send(usock, db)
+            sockets = [usock for usock, _, user in self.get_connections() if user not in excepted]
         else:
-            for usock, _, _ in self.get_connections():
-                socket.send(usock, db)
+            sockets = [usock for usock, _, _ in self.get_connections()]
+
+        self.server.fanout.broadcast(sockets, packet, droppable)
 
     def broadcast_servermsg(self, msg, channel_data=False):
         if channel_data:
@@ -100,18 +124,17 @@ class Channel:
     def user_joined(self, c_user):
         user = c_user.user
 
-        # SEND MESSAGE LOG
         result = True
 
         if user in self.blacklist:
             self.send_servermsg(c_user, "+orangered(You blocked from this channel!)")
             result = False
 
-        if len(self.users) >= self.userlimit != -1 and c_user not in self.second_admins:
+        if len(self.users) >= self.userlimit != -1 and user not in self.second_admins:
             self.send_servermsg(c_user, "+orangered(Maximum users connected!)")
             result = False
 
-        if self.whitelist_enabled and user not in self.whitelist and c_user not in self.second_admins:
+        if self.whitelist_enabled and user not in self.whitelist and user not in self.second_admins:
             self.send_servermsg(c_user, "+orangered(You cannot join this channel!)")
             result = False
 
@@ -119,10 +142,13 @@ class Channel:
             if self.name == "__global__":
                 self.server.socket.kick(c_user.uconn.socket)
         else:
-            self.users.append(c_user)
+            self.users[user] = c_user
+            self.permissions.pop(user, None)
             c_user.channels.append(self.name)
 
             self.send_packet(c_user, {'type': 'channel_set', 'channel': self.name})
+            if self.history:
+                self.server.send_history(c_user.uconn.socket, self.history)
             self.broadcast_servermsg(f"{user.username} +green(joined)", True)
 
     def user_rename(self, c_user, old_name):
@@ -131,7 +157,8 @@ class Channel:
     def user_left(self, c_user):
         self.broadcast_servermsg(f"{c_user.user.username} +orangered(left)", True)
         self.send_packet(c_user, {'type': 'channel_remove', 'channel': self.name})
-        self.users.remove(c_user)
+        del self.users[c_user.user]
+        self.permissions.pop(c_user.user, None)
 
         c_user.channels.remove(self.name)
 
@@ -139,19 +166,33 @@ class Channel:
         self.broadcast_servermsg(f"+orangered(Channel deleted)", True)
         self.broadcast_packet({'type': 'channel_remove', 'channel': self.name})
 
+        self.close()
+
+    def close(self):  # detaches local users without notifying them
         if self is self.server.connected_channel:
             self.server.connected_channel = self.server.global_channel
 
-        for user in self.users:
-            user.channels.remove(self.name)
+        for c_user in self.users.values():
+            c_user.channels.remove(self.name)
 
         self.users.clear()
+        self.permissions.clear()
+
+    def clear_log(self, relay=True):
+        self.history.clear()
+        self.search.clear()
+
+        if self.shard is None and self.server.store:
+            self.server.store.clear(self.name)
+
+        if relay and self.server.bus:  # the mirrors on other workers keep a history of their own
+            self.server.bus.publish({'type': 'clearlog', 'channel': self.name})
 
     def get_userlist(self):
         if len(self.users) == 0:
             return "+orangered(No users connected)"
 
-        userlist = [f"{user.username} ({user.addr})" for _, user, _, _ in self.users]
+        userlist = [f"{user.username} ({user.addr})" for user in self.users]
         return '\n'.join([f"Users ({len(self.users)}):"] + userlist)
 
     def write_message(self, user, message):
@@ -174,12 +215,9 @@ class Channel:
         c_user = self.find_user(user)
 
         if c_user:
-            if self.write_right and self.write_right not in c_user.channel_rights[self.name]:
-                if user != self.admin_user and user not in self.second_admins:
-                    self.server.send_servermsg(c_user.uconn.socket, "+orangered(You cannot write in this channel!)")
-                    return
-
-            self.message_log.append((user, message))
+            if not self.get_permissions(c_user) & PERM_WRITE:
+                self.server.send_servermsg(c_user.uconn.socket, "+orangered(You cannot write in this channel!)")
+                return
 
             if self.name == self.server.connected_channel:
                 self.server.ui.write(f"{c_user.user.username} : {message}")
@@ -207,7 +245,15 @@ class Channel:
         cmd_s = cmd.split()
 
         if user != "Server":
-            user = self.find_user(user)
+            c_user = self.find_user(user)
+
+            if not c_user:
+                uconn = self.server.uconnections.find_by_uname(user.username_p)
+                if uconn:
+                    self.server.send_servermsg(uconn.socket, "+orangered(You are not connected to this channel!)")
+                return
+
+            user = c_user
 
         if user == self.admin_user:
             if cmd_s[0] == "/giveadmin":
@@ -215,7 +261,7 @@ class Channel:
             elif cmd_s[0] == "/takeadmin":
                 self.remove_second_admin(cmd_s[1])
 
-        if user == self.admin_user or user in self.second_admins:
+        if self.is_admin(user):
             if cmd_s[0] == "/whitelist":
                 if cmd_s[1] == "on":
                     self.whitelist_on()
@@ -233,7 +279,7 @@ class Channel:
                 elif cmd_s[1] == "write":
                     self.set_write_right(cmd_s[2])
             elif cmd_s[0] == "/clearlog":
-                self.message_log.clear()
+                self.clear_log()
                 self.broadcast_servermsg("+green(Message log cleared)", True)
 
             if self.name == "__global__":
@@ -251,11 +297,15 @@ class Channel:
             # dont delete channels, created by server
             # make hide command
             # TODO - make commands
-        if cmd_s[0] == "/userlist":
+        if cmd_s[0] == "/stats" and user == "Server":
+            self.server.ui.write(self.server.get_stats())
+        elif cmd_s[0] == "/userlist":
             if user == "Server":
                 self.server.ui.write(self.get_userlist())
             else:
                 self.send_servermsg(user, self.get_userlist())
+        elif cmd_s[0] == "/search" and len(cmd_s) > 1:
+            self.search_messages(user, cmd_s[1:])
         elif cmd_s[0] == "/channel":
             if cmd_s[1] == "list":
                 if user == "Server":
@@ -269,6 +319,24 @@ class Channel:
             elif cmd_s[1] == "create":
                 self.channel_create(user, cmd_s[2])
 
+    def search_messages(self, user, args):  # /search [page] words
+        page = 0
+        if len(args) > 1 and args[0].isdecimal():
+            page = max(int(args[0]) - 1, 0)
+            args = args[1:]
+
+        results = self.search.search(' '.join(args), page)
+
+        if results:
+            msg = '\n'.join([f"+green(Found, page {page + 1}:)"] + [f"{uname} : {text}" for uname, text in results])
+        else:
+            msg = "+orangered(Nothing found)"
+
+        if user == "Server":
+            self.server.ui.write(msg)
+        else:
+            self.send_servermsg(user, msg)
+
     def channel_join(self, user, channel_name):
         if user == "Server":
             channel = self.channels.find_channel(channel_name)
@@ -311,28 +379,30 @@ class Channel:
     def whitelist_add(self, uname):
         user = self.find_user_by_name(uname)
         if user:
-            self.whitelist.append(user)
+            self.whitelist.add(user.user)
             self.broadcast_servermsg(f"+green({user.username} added to whitelist)", True)
 
     def add_second_admin(self, uname):
         c_user = self.find_user_by_name(uname)
 
         if c_user:
-            self.second_admins.append(c_user)
+            self.second_admins.add(c_user.user)
+            self.permissions.pop(c_user.user, None)
             self.broadcast_servermsg(f"+green({c_user.user.username} is now an admin of this channel)", True)
 
     def remove_second_admin(self, uname):
         c_user = self.find_user_by_name(uname)
-        if c_user and c_user in self.second_admins:
-            self.second_admins.remove(c_user)
+        if c_user and c_user.user in self.second_admins:
+            self.second_admins.discard(c_user.user)
+            self.permissions.pop(c_user.user, None)
             self.broadcast_servermsg(f"+orangered({c_user.user.username} is no longer an admin)", True)
 
     def add_user_right(self, uname, right):
         c_user = self.find_user_by_name(uname)
 
         if c_user:
-            if right not in c_user.channel_rights[self.name]:
-                c_user.channel_rights[self.name].append(right)
+            c_user.channel_rights[self.name].add(right)
+            self.permissions.pop(c_user.user, None)
             self.broadcast_servermsg(f"+green(+right:{right} for {uname})", True)
 
     def remove_user_right(self, admin, uname, right):
@@ -341,11 +411,14 @@ class Channel:
         if c_user:
             if right in c_user.channel_rights[self.name]:
                 c_user.channel_rights[self.name].remove(right)
+                self.permissions.pop(c_user.user, None)
                 self.broadcast_servermsg(f"+orangered(-right:{right} for {uname})", True)
             else:
                 self.send_servermsg(admin, f"+orangered({uname} doesnt have this right!)")
 
     def set_write_right(self, right):
+        self.permissions.clear()
+
         if right == "*":
             self.write_right = None
             self.broadcast_servermsg("+green(Now all users can write to this channel!)", True)
@@ -354,10 +427,10 @@ class Channel:
             self.broadcast_servermsg(f"+green(Only users with right:{right} can write to this channel)", True)
 
     def blacklist_add_user(self, user):
-        self.blacklist.append(user)
+        self.blacklist.add(user)
 
     def blacklist_remove_user(self, user):
-        self.blacklist.remove(user)
+        self.blacklist.discard(user)
 
     # ADD CLEAR MESSAGES COMMAND
 
@@ -367,15 +440,17 @@ class ChannelList:
         self.server = server
         self.userlist = server.userlist
 
-        self.channels = list()
-        self.channel_users = list()
+        self.channels = dict()  # name -> channel
+        self.channel_users = dict()  # user -> channel user
+
+        self.remote = dict()  # channel name -> (admin name, shard) for channels owned by other workers or nodes
 
     def get_channel_table(self):
         table = list()
         table.append("+green(Channels:)")
 
-        for channel in self.channels:
-            if channel.hidden:
+        for channel in self.channels.values():
+            if channel.hidden or channel.shard is not None:
                 continue
 
             admin_name = "+yellow(Server)" if channel.admin_user == "Server" else channel.admin_user.user.username
@@ -387,20 +462,56 @@ class ChannelList:
                 table.append(f"+black({channel.name}) +green(:    admin - {admin_name}"
                              f"    users - {connected}/{channel.userlimit}")
 
+        for name, (admin_name, shard) in self.remote.items():
+            table.append(f"+black({name}) +green(:    admin - {admin_name}    on - {shard})")
+
         return '\n'.join(table)
 
     def add_channel(self, channel):
-        self.channels.append(channel)
+        self.channels[channel.name] = channel
 
     def create_channel(self, admin_user, name):
         if not self.find_channel(name):
             chan = Channel(self.server, name, admin_user)
-            self.channels.append(chan)
+            self.channels[name] = chan
+
+            if self.server.store:  # left by a channel of this name before a restart
+                self.server.store.remove(name)
+            self.publish_channel(chan)
             return chan
 
     def destroy_channel(self, channel):
         channel.destroy()
-        self.channels.remove(channel)
+        del self.channels[channel.name]
+
+        if self.server.store and channel.shard is None:
+            self.server.store.remove(channel.name)
+
+        if self.server.bus and channel.shard is None:
+            self.server.bus.publish({'type': 'channel_remove', 'channel': channel.name})
+
+    def publish_channel(self, channel, shard=None):  # to every worker, or to the given one
+        if not self.server.bus or channel.shard is not None or channel.name == "__global__":
+            return
+
+        admin_name = "Server" if channel.admin_user == "Server" else channel.admin_user.user.username
+        message = {'type': 'channel', 'channel': channel.name, 'admin': admin_name}
+
+        if shard is None:
+            self.server.bus.publish(message)
+        else:
+            self.server.bus.send(shard, message)
+
+    def remote_channel(self, name, admin_name, shard):
+        self.remote[name] = (admin_name, shard)
+
+    def remote_channel_removed(self, name):  # its users were already told by the owner
+        self.remote.pop(name, None)
+
+        channel = self.find_channel(name)
+        if channel and channel.shard is not None:
+            channel.close()
+            del self.channels[name]
 
     def send_user(self, user, channel):
         last_channel = None
@@ -411,14 +522,13 @@ class ChannelList:
         if channel:
             if last_channel:
                 if user == last_channel.admin_user:
-                    last_channel.destroy()
-                    self.channels.remove(last_channel)
+                    self.destroy_channel(last_channel)
                 else:
                     last_channel.user_left(user)
 
             if channel.name != "__global__":
                 if channel.name not in user.channel_rights:
-                    user.channel_rights[channel.name] = list()
+                    user.channel_rights[channel.name] = set()
                 channel.user_joined(user)
 
     def user_joined(self, uconn, channel_name):
@@ -429,12 +539,12 @@ class ChannelList:
             return
 
         if c_user:
-            self.channel_users.remove(c_user)
+            del self.channel_users[c_user.user]
 
         c_user = channel_user(uconn, uconn.user, [], dict())
-        self.channel_users.append(c_user)
+        self.channel_users[uconn.user] = c_user
 
-        c_user.channel_rights[channel_name] = list()
+        c_user.channel_rights[channel_name] = set()
 
         channel.user_joined(c_user)
 
@@ -452,37 +562,37 @@ class ChannelList:
 
         if channel and c_user:
             if user == channel.admin_user:
-                channel.destroy()
-                self.channels.remove(channel)
+                self.destroy_channel(channel)
             else:
                 channel.user_left(c_user)
 
     def user_disconnected(self, user):
-        c_user = self.find_user(user)
+        c_user = self.channel_users.pop(user, None)
 
         if c_user:
-            for channel_name in c_user.channels:
-                channel = self.find_channel(channel_name)
+            for channel_name in list(c_user.channels):
+                channel = self.find_channel(channel_name, False)
+                if not channel:
+                    continue
                 if c_user.user == channel.admin_user:
-                    channel.destroy()
-                    self.channels.remove(channel)
+                    self.destroy_channel(channel)
                     continue
                 channel.user_left(c_user)
 
-    def find_channel(self, name):
-        for channel in self.channels:
-            if channel.name == name:
-                return channel
+    def find_channel(self, name, remote=True):
+        channel = self.channels.get(name)
+
+        if not channel and remote and name in self.remote:  # local copy of a channel owned by another worker
+            channel = Channel(self.server, name, None, self.remote[name][1])
+            self.channels[name] = channel
+
+        return channel
 
     def find_user(self, user):
-        for c_user in self.channel_users:
-            if c_user.user == user:
-                return c_user
+        return self.channel_users.get(user)
 
     def find_user_by_name(self, name):
-        for c_user in self.channel_users:
-            if c_user.user.username_p == name:
-                return c_user
+        return self.channel_users.get(self.userlist.find_by_name(name))
 
 
 class DirectMessages:
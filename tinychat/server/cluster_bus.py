@@ -0,0 +1,214 @@
+from tinychat.network import CodecError, FrameDecoder, FrameError, binary_codec, pack_frame, pack_fragments, MAX_FRAME_SIZE
+from socket import *
+from threading import Thread, Lock, Event
+
+GOSSIP_INTERVAL = 2  # seconds between peer list exchanges and reconnects
+
+
+class PeerLink:
+    def __init__(self, sock, dialer):
+        self.socket = sock
+        self.dialer = dialer  # node that opened the connection
+        self.node = None  # set by the handshake
+
+        self.lock = Lock()
+
+    def send(self, data):
+        with self.lock:
+            if len(data) > MAX_FRAME_SIZE:
+                for fragment in pack_fragments(data):
+                    self.socket.sendall(fragment)
+            else:
+                self.socket.sendall(pack_frame(data))
+
+    def close(self):
+        try:
+            self.socket.shutdown(SHUT_RDWR)
+        except error:
+            pass
+        self.socket.close()
+
+
+class ClusterBus:
+    # tcp links between the nodes of a cluster, with the same interface as ShardBus.
+    # nodes are named "host:port" by their cluster address and learn about each other by gossip
+    def __init__(self, host, port, seeds, exception_handler):
+        self.shard = f"{host}:{port}"  # this node
+        self.primary = True  # every node announces itself in its own lan
+
+        self.addr = (host, port)
+        self.known = set(seeds) - {self.shard}  # other nodes, "host:port"
+
+        self.post = None  # gets ("bus", message) events, set by the Server
+        self.exception = exception_handler
+
+        self.links = dict()  # node -> PeerLink
+        self._lock = Lock()
+
+        self._socket = None
+        self._running = False
+        self._stop = Event()
+        self._threads = list()
+
+    def open(self):
+        self._socket = socket(AF_INET, SOCK_STREAM)
+        self._socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self._socket.bind(self.addr)
+        self._socket.listen()
+
+        self._running = True
+
+        for target in (self._accept_main, self._gossip_main):
+            thread = Thread(target=target)
+            thread.start()
+            self._threads.append(thread)
+
+    def _accept_main(self):
+        while self._running:
+            try:
+                sock, _ = self._socket.accept()
+            except error:
+                break
+
+            self._start_link(PeerLink(sock, None))
+
+    def _gossip_main(self):
+        while self._running:
+            with self._lock:
+                missing = self.known - set(self.links)
+                peers = sorted(self.known | {self.shard})
+
+            for node in missing:
+                self._dial(node)
+
+            self.publish({'type': 'peers', 'peers': peers})
+
+            if self._stop.wait(GOSSIP_INTERVAL):
+                break
+
+    def _dial(self, node):
+        host, port = node.rsplit(':', 1)
+
+        try:
+            sock = create_connection((host, int(port)), timeout=GOSSIP_INTERVAL)
+            sock.settimeout(None)
+        except error:
+            return  # node is down, retried on the next gossip round
+
+        self._start_link(PeerLink(sock, self.shard))
+
+    def _start_link(self, link):
+        link.socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+        thread = Thread(target=self._link_main, args=(link,), daemon=True)
+        thread.start()
+
+        self._send_link(link, {'type': 'node', 'dialer': link.dialer})
+
+    def _link_main(self, link):
+        decoder = FrameDecoder()
+
+        try:
+            while self._running:
+                if not decoder.recv_into(link.socket):
+                    break
+
+                for data in decoder.frames():
+                    message = binary_codec.decode(data)
+
+                    if message['type'] == 'node':
+                        if not self._handshake(link, message):
+                            return
+                    elif message['type'] == 'peers':
+                        with self._lock:
+                            self.known.update(set(message['peers']) - {self.shard})
+                    elif link.node:
+                        self.post(("bus", message))
+
+        except (error, FrameError, CodecError, KeyError) as e:
+            self.exception(e)
+        finally:
+            self._link_lost(link)
+
+    def _handshake(self, link, message):
+        node = message['shard']
+
+        if link.dialer is None:
+            link.dialer = message['dialer']
+
+        with self._lock:
+            current = self.links.get(node)
+
+            # both nodes dialed each other: both keep the link dialed by the smaller name
+            if current and current.dialer != link.dialer and current.dialer < link.dialer:
+                link.close()
+                return False
+
+            self.links[node] = link
+            self.known.add(node)
+
+        link.node = node
+
+        if current:
+            current.node = None  # its reader must not report the node as lost
+            current.close()
+
+        self.post(("bus", {'type': 'hello', 'shard': node}))  # send our users and channels to the node
+        return True
+
+    def _link_lost(self, link):
+        link.close()
+
+        with self._lock:
+            if link.node is None or self.links.get(link.node) is not link:
+                return
+            del self.links[link.node]
+
+        if self._running:
+            self.post(("bus", {'type': 'node_down', 'shard': link.node}))
+
+    def _send_link(self, link, message):
+        message = dict(message, shard=self.shard)
+
+        try:
+            link.send(binary_codec.encode(message))
+        except CodecError as e:
+            self.exception(e)
+        except error:
+            pass  # the reader thread notices the closed link
+
+    def send(self, node, message):
+        link = self.links.get(node)
+        if link:
+            self._send_link(link, message)
+
+    def publish(self, message):  # one copy per node, whatever the number of its users
+        with self._lock:
+            links = list(self.links.values())
+
+        for link in links:
+            self._send_link(link, message)
+
+    def close(self):
+        if not self._running:
+            return
+
+        self._running = False
+        self._stop.set()
+
+        try:
+            self._socket.shutdown(SHUT_RDWR)
+        except error:
+            pass
+        self._socket.close()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+        with self._lock:
+            links = list(self.links.values())
+            self.links.clear()
+
+        for link in links:
+            link.close()
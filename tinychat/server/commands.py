@@ -6,6 +6,7 @@ helptxt = """
 /name (новое имя сервера) - изменить имя сервера
 /desc (новое описание) - изменить описание сервера
 /userlist - список пользователей
+/stats - статистика сети
 /giveadmin (user) - выдать права администратора
 /takeadmin (user) - забрать права администратора
 
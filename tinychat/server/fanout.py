@@ -0,0 +1,163 @@
+from tinychat.network import json_codec, available_codecs
+from collections import deque
+from queue import Queue
+from threading import Thread, Lock
+import time
+
+FANOUT_THREADS = 4
+FANOUT_THRESHOLD = 256  # smaller broadcasts are sent inline by the event thread
+
+
+class FanoutStats:
+    def __init__(self, window=1000):
+        self.inline = 0
+        self.parallel = 0
+        self.total = 0
+        self.max = 0
+        self.recent = deque(maxlen=window)  # for the percentile
+
+        self.lock = Lock()
+
+    def add(self, elapsed, parallel):
+        with self.lock:
+            if parallel:
+                self.parallel += 1
+            else:
+                self.inline += 1
+
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+            self.recent.append(elapsed)
+
+    def get(self):
+        with self.lock:
+            count = self.inline + self.parallel
+            recent = sorted(self.recent)
+
+        return {
+            'broadcasts_inline': self.inline,
+            'broadcasts_parallel': self.parallel,
+            'last_recipient_avg_ms': round(self.total / count * 1000, 3) if count else 0,
+            'last_recipient_p99_ms': round(recent[int(len(recent) * 0.99)] * 1000, 3) if recent else 0,
+            'last_recipient_max_ms': round(self.max * 1000, 3)
+        }
+
+
+class FanoutJob:
+    def __init__(self, data, droppable, parts):
+        self.data = data  # codec name -> encoded packet
+        self.droppable = droppable
+        self.start = time.perf_counter()
+        self.finished = self.start  # when the send of the last recipient returned
+
+        self.pending = parts
+        self.lock = Lock()
+
+
+class Fanout:
+    # every recipient always goes to the same sender thread, so its frames stay in order. While
+    # the threads have work, small broadcasts and direct sends queue behind it instead of
+    # overtaking it inline
+    def __init__(self, server, threads=FANOUT_THREADS, threshold=FANOUT_THRESHOLD):
+        self.server = server
+        self.threshold = threshold
+
+        self.stats = FanoutStats()
+
+        self._queues = [Queue() for _ in range(threads)]
+        self._threads = list()
+
+        self._inflight = [0] * threads  # items queued or being sent, by thread
+        self._inflight_lock = Lock()
+
+    def send(self, socket, data, droppable=False):  # one encoded packet, in order with the broadcasts
+        n = hash(socket) % len(self._queues)
+
+        if not self._inflight[n]:
+            return self.server.socket.send(socket, data, droppable)
+
+        with self._inflight_lock:
+            self._inflight[n] += 1
+        self._queues[n].put((None, (socket, data, droppable)))
+        return True
+
+    def broadcast(self, sockets, packet, droppable=False):
+        if len(sockets) < self.threshold and not any(self._inflight):
+            self._send_inline(sockets, packet, droppable)
+            return
+
+        if not self._threads:
+            self._start()
+
+        buckets = [list() for _ in self._queues]
+        for s in sockets:
+            buckets[hash(s) % len(buckets)].append(s)
+
+        data = {name: codec.encode(packet) for name, codec in available_codecs.items()}
+        job = FanoutJob(data, droppable, sum(1 for bucket in buckets if bucket))
+
+        if not job.pending:
+            return
+
+        with self._inflight_lock:
+            for n, bucket in enumerate(buckets):
+                if bucket:
+                    self._inflight[n] += 1
+
+        for queue, bucket in zip(self._queues, buckets):
+            if bucket:
+                queue.put((job, bucket))
+
+    def _send_inline(self, sockets, packet, droppable):
+        start = time.perf_counter()
+
+        encode = self.server.encode
+        send = self.server.socket.send
+        cache = dict()
+
+        for s in sockets:
+            send(s, encode(s, packet, cache), droppable)
+
+        self.stats.add(time.perf_counter() - start, False)
+
+    def _start(self):
+        for n, queue in enumerate(self._queues):
+            thread = Thread(target=self._threadmain, args=(n, queue), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _threadmain(self, n, queue):
+        for job, bucket in iter(queue.get, None):
+            send = self.server.socket.send
+
+            if job is None:  # a direct send
+                send(*bucket)
+            else:
+                codecs = self.server.codecs
+                data = job.data
+
+                for s in bucket:
+                    send(s, data[codecs.get(s, json_codec).name], job.droppable)
+                finished = time.perf_counter()
+
+                with job.lock:
+                    job.pending -= 1
+                    job.finished = max(job.finished, finished)
+                    last = not job.pending
+
+                if last:
+                    self.stats.add(job.finished - job.start, True)
+
+            with self._inflight_lock:
+                self._inflight[n] -= 1
+
+    def close(self):
+        if not self._threads:
+            return
+
+        for queue in self._queues:
+            queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
@@ -0,0 +1,43 @@
+from tinychat.network import available_codecs
+from collections import deque
+
+HISTORY_MESSAGES = 100
+HISTORY_BYTES = 256 * 1024  # all the stored encodings together
+
+
+class MessageHistory:
+    # the last messages of a channel, encoded once with every codec so joins replay them without encoding
+    def __init__(self, count=HISTORY_MESSAGES, size=HISTORY_BYTES):
+        self.count = count
+        self.size = size
+
+        self.bytes = 0
+        self._entries = deque()  # codec name -> encoded packet, oldest first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, packet):
+        entry = {name: codec.encode(packet) for name, codec in available_codecs.items()}
+
+        self._entries.append(entry)
+        self.bytes += sum(map(len, entry.values()))
+
+        self._trim()
+
+    def encoded(self, codec_name):
+        return [entry[codec_name] for entry in self._entries]
+
+    def resize(self, count, size):
+        self.count = count
+        self.size = size
+        self._trim()
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _trim(self):
+        while self._entries and (len(self._entries) > self.count or self.bytes > self.size):
+            entry = self._entries.popleft()
+            self.bytes -= sum(map(len, entry.values()))
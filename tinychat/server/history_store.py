@@ -0,0 +1,332 @@
+from tinychat.network import CodecError, binary_codec
+from bisect import bisect_right
+from queue import Queue, Empty
+from threading import Thread, Lock
+import mmap
+import os
+import shutil
+import struct
+import time
+
+SEGMENT_MESSAGES = 64 * 1024  # index entries preallocated per segment
+ROLLOVER_INTERVAL = 24 * 3600  # seconds before a new segment is started, even if the last one is not full
+RETENTION_SEGMENTS = 64  # per channel, older segments are deleted
+RETENTION_AGE = None  # seconds since the last write of a segment, None keeps them
+
+WRITE_BATCH = 1024  # messages written with one flush
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+index_entry = struct.Struct(">QI")  # offset and length of a message in the log
+
+CLEAR = "clear"  # queued instead of a packet, in order with the messages of the channel
+REMOVE = "remove"
+
+
+class Segment:
+    # messages base.. of a channel: a log of encoded packets and a fixed size index, mapped into memory
+    def __init__(self, path, base, capacity):
+        self.base = base
+        self.opened = time.monotonic()
+
+        self.log_path = os.path.join(path, f"{base:020}.log")
+        self.index_path = os.path.join(path, f"{base:020}.idx")
+
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, 'wb') as f:
+                f.truncate(capacity * index_entry.size)
+
+        self._log = open(self.log_path, 'a+b')
+        self._index_file = open(self.index_path, 'r+b')
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        self.capacity = len(self._index) // index_entry.size
+
+        self.count = self._recover()
+        self.size = self._end(self.count)
+
+        self._log.truncate(self.size)  # drops a message written without its index entry
+
+    def _recover(self):  # entries are filled in order and a message is never empty
+        lo, hi = 0, self.capacity
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if index_entry.unpack_from(self._index, mid * index_entry.size)[1]:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _end(self, count):
+        if not count:
+            return 0
+        offset, length = index_entry.unpack_from(self._index, (count - 1) * index_entry.size)
+        return offset + length
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, datas):  # the index is written after the data it points to
+        self._log.write(b''.join(datas))
+        self._log.flush()
+
+        offset = self.size
+        for data in datas:
+            index_entry.pack_into(self._index, self.count * index_entry.size, offset, len(data))
+            offset += len(data)
+            self.count += 1
+
+        self.size = offset
+
+    def read(self, start, end):  # positions in this segment
+        if start >= end:
+            return []
+
+        first = index_entry.unpack_from(self._index, start * index_entry.size)[0]
+        data = os.pread(self._log.fileno(), self._end(end) - first, first)
+
+        messages = list()
+        for pos in range(start, end):
+            offset, length = index_entry.unpack_from(self._index, pos * index_entry.size)
+            messages.append(data[offset - first:offset - first + length])
+        return messages
+
+    def last_write(self):
+        return os.path.getmtime(self.log_path)
+
+    def close(self):
+        self._index.flush()
+        self._index.close()
+        self._index_file.close()
+        self._log.close()
+
+    def delete(self):
+        self.close()
+        os.remove(self.log_path)
+        os.remove(self.index_path)
+
+
+class ChannelLog:
+    # messages of a channel numbered from 0, split into segments named by their first number
+    def __init__(self, path, segment_messages=SEGMENT_MESSAGES, rollover=ROLLOVER_INTERVAL,
+                 retention=RETENTION_SEGMENTS, max_age=RETENTION_AGE):
+        self.path = path
+        self.segment_messages = segment_messages
+        self.rollover = rollover
+        self.retention = retention
+        self.max_age = max_age
+
+        self.lock = Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        bases = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith(".idx"))
+        self.segments = [Segment(path, base, segment_messages) for base in bases]
+
+        if not self.segments:
+            self.segments.append(Segment(path, 0, segment_messages))
+
+    @property
+    def first(self):
+        return self.segments[0].base
+
+    @property
+    def next(self):
+        return self.segments[-1].base + self.segments[-1].count
+
+    def append(self, datas):
+        with self.lock:
+            while datas:
+                active = self.segments[-1]
+
+                if active.full() or active.count and time.monotonic() - active.opened > self.rollover:
+                    self._roll()
+                    continue
+
+                part = datas[:active.capacity - active.count]
+                active.append(part)
+                datas = datas[len(part):]
+
+    def _roll(self):
+        self.segments.append(Segment(self.path, self.next, self.segment_messages))
+        self.expire()
+
+    def expire(self):  # never the segment being written
+        while len(self.segments) > max(self.retention, 1):
+            self.segments.pop(0).delete()
+
+        if self.max_age is not None:
+            while len(self.segments) > 1 and time.time() - self.segments[0].last_write() > self.max_age:
+                self.segments.pop(0).delete()
+
+    def clear(self):  # the numbers go on from the last message, so older cursors find nothing
+        with self.lock:
+            if self.segments[-1].count:  # an empty one is kept, a new one would open the same files
+                self.segments.append(Segment(self.path, self.next, self.segment_messages))
+
+            while len(self.segments) > 1:
+                self.segments.pop(0).delete()
+
+    def read(self, before=None, after=None, limit=PAGE_SIZE):  # -> number of the first message, messages
+        with self.lock:
+            first, end = self.first, self.next
+
+            if after is not None:
+                start = max(after + 1, first)
+                end = min(start + limit, end)
+            else:
+                if before is not None:
+                    end = min(before, end)
+                start = max(end - limit, first)
+
+            messages = list()
+            pos = start
+            index = bisect_right([segment.base for segment in self.segments], start) - 1
+
+            while pos < end:
+                segment = self.segments[index]
+                stop = min(end, segment.base + segment.count)
+
+                messages += segment.read(pos - segment.base, stop - segment.base)
+
+                pos = stop
+                index += 1
+
+            return start, messages
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+
+
+class HistoryStore:
+    # messages of every channel on disk, see ChannelLog. The event thread only queues them,
+    # a thread of its own encodes and writes them in batches
+    def __init__(self, path, exception_handler, **log_options):
+        self.path = path
+        self.exception = exception_handler
+        self.log_options = log_options
+
+        self.logs = dict()  # channel name -> ChannelLog
+        self._lock = Lock()
+
+        self._queue = Queue()
+        self._thread = None
+
+    def open(self):
+        self._thread = Thread(target=self._writer_main)
+        self._thread.start()
+
+    def append(self, channel, packet):
+        self._queue.put((channel, packet))
+
+    def clear(self, channel):  # /clearlog, the messages queued before it are not written
+        self._queue.put((channel, CLEAR))
+
+    def remove(self, channel):  # the channel is deleted, a new one with its name starts empty
+        self._queue.put((channel, REMOVE))
+
+    def get_log(self, channel):
+        with self._lock:
+            log = self.logs.get(channel)
+
+            if log is None:
+                log = self.logs[channel] = ChannelLog(self._log_path(channel), **self.log_options)
+            return log
+
+    def _log_path(self, channel):  # any name is a safe directory name in hex
+        return os.path.join(self.path, channel.encode('utf8').hex())
+
+    def page(self, channel, before=None, after=None, limit=PAGE_SIZE):
+        first, messages = self.get_log(channel).read(before, after, min(limit, MAX_PAGE_SIZE))
+        return first, [binary_codec.decode(data) for data in messages]
+
+    def last(self, channel, limit):  # -> the newest messages of a channel kept on disk, oldest first
+        if channel not in self.logs and not os.path.exists(self._log_path(channel)):
+            return []
+
+        _, messages = self.get_log(channel).read(limit=limit)
+        return [binary_codec.decode(data) for data in messages]
+
+    def _writer_main(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=60)
+            except Empty:
+                self._expire()
+                continue
+
+            batch = [item]
+            try:
+                while len(batch) < WRITE_BATCH and batch[-1] is not None:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                pass
+
+            self._write(batch)
+
+            if batch[-1] is None:
+                break
+
+    def _write(self, batch):
+        channels = dict()  # channel name -> encoded packets, in order
+
+        for item in batch:
+            if item is None:
+                continue
+
+            channel, packet = item
+
+            if packet is CLEAR or packet is REMOVE:
+                channels.pop(channel, None)
+
+                try:
+                    self._clear(channel, packet is REMOVE)
+                except OSError as e:
+                    self.exception(e)
+                continue
+
+            try:
+                channels.setdefault(channel, list()).append(binary_codec.encode(packet))
+            except CodecError as e:
+                self.exception(e)
+
+        for channel, datas in channels.items():
+            try:
+                self.get_log(channel).append(datas)
+            except OSError as e:
+                self.exception(e)
+
+    def _clear(self, channel, remove):
+        if not remove:
+            self.get_log(channel).clear()
+            return
+
+        with self._lock:
+            log = self.logs.pop(channel, None)
+
+            if log:
+                log.close()
+
+            path = self._log_path(channel)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def _expire(self):
+        with self._lock:
+            logs = list(self.logs.values())
+
+        for log in logs:
+            with log.lock:
+                log.expire()
+
+    def close(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            for log in self.logs.values():
+                log.close()
+            self.logs.clear()
@@ -0,0 +1,51 @@
+from tinychat.gui.colors import colored_text, parse2
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+import logging
+
+
+class NullUi:
+    def write(self, text):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LogUi:  # server output without a window, the lines are written by the thread of start_logging()
+    def __init__(self, name="tinychat.server"):
+        self.logger = logging.getLogger(name)
+
+    def write(self, text):
+        self.logger.info(text)
+
+    def clear(self):
+        pass
+
+
+class MarkupFormatter(logging.Formatter):
+    def format(self, record):
+        if isinstance(record.msg, colored_text):
+            record.msg = record.msg.text
+        elif isinstance(record.msg, str) and not record.args:
+            record.msg = parse2(record.msg).text  # the colors are stripped off the event thread
+
+        return super().format(record)
+
+
+class LocalQueueHandler(QueueHandler):
+    def prepare(self, record):  # formatted later by the listener thread
+        return record
+
+
+def start_logging(handler, level=logging.INFO):  # -> the listener, stop() it on exit
+    handler.setFormatter(MarkupFormatter("%(asctime)s %(name)s: %(message)s"))
+
+    queue = Queue()
+    logger = logging.getLogger("tinychat")
+    logger.addHandler(LocalQueueHandler(queue))
+    logger.setLevel(level)
+
+    listener = QueueListener(queue, handler)
+    listener.start()
+    return listener
@@ -0,0 +1,123 @@
+from tinychat.gui.colors import parse2
+from array import array
+from bisect import bisect_left
+from collections import deque
+import re
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_MESSAGES = 100000  # per channel, far more than the history replayed on join
+SEARCH_BYTES = 16 * 1024 * 1024
+
+word_pat = re.compile(r"\w+")
+
+
+def tokenize(text):  # words of the displayed text, without the color markup
+    return set(word_pat.findall(parse2(text).text.lower()))
+
+
+class SearchIndex:
+    # inverted index of the last messages of a channel, filled from the HistoryStore on start.
+    # Documents are numbered in the order they are added, the oldest ones are dropped first.
+    # Postings keep the numbers of dropped documents until they make up half of the entries
+    def __init__(self, count=SEARCH_MESSAGES, size=SEARCH_BYTES):
+        self.count = count
+        self.size = size  # of the texts and usernames together
+
+        self.first = 0  # number of the oldest document
+        self.bytes = 0
+        self.documents = deque()  # (username, text, words)
+        self.postings = dict()  # word -> array of document numbers, ascending
+
+        self.entries = 0  # in the postings, of the kept documents
+        self.dropped = 0  # of the dropped documents
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, username, text):
+        doc = self.first + len(self.documents)
+        words = tokenize(text)
+
+        self.documents.append((username, text, words))
+        self.bytes += len(username) + len(text)
+        self.entries += len(words)
+
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = array('I')
+            posting.append(doc)
+
+        self._trim()
+
+    def load(self, packets):  # stored messages, oldest first
+        for packet in packets:
+            if packet.get('type') == 'message':
+                self.add(packet['user'], packet['text'])
+
+    def resize(self, count, size):
+        self.count = count
+        self.size = size
+        self._trim()
+
+    def clear(self):
+        self.first += len(self.documents)
+        self.bytes = 0
+        self.documents.clear()
+        self.postings.clear()
+        self.entries = self.dropped = 0
+
+    def _trim(self):
+        while self.documents and (len(self.documents) > self.count or self.bytes > self.size):
+            username, text, words = self.documents.popleft()
+            self.bytes -= len(username) + len(text)
+            self.entries -= len(words)
+            self.dropped += len(words)
+            self.first += 1
+
+        if self.dropped > self.entries:
+            self._compact()
+
+    def _compact(self):  # the dropped documents are at the start of each posting
+        first = self.first
+
+        for word, posting in list(self.postings.items()):
+            start = bisect_left(posting, first)
+            if start == len(posting):
+                del self.postings[word]
+            elif start:
+                del posting[:start]
+
+        self.dropped = 0
+
+    def search(self, query, page=0, size=SEARCH_PAGE_SIZE):  # newest first
+        words = tokenize(query)
+        if not words:
+            return []
+
+        postings = sorted((self.postings.get(word, ()) for word in words), key=len)
+        shortest, others = postings[0], postings[1:]
+
+        skip = page * size
+        results = list()
+
+        for doc in reversed(shortest):
+            if doc < self.first:
+                break
+
+            if all(contains(posting, doc) for posting in others):
+                if skip:
+                    skip -= 1
+                    continue
+
+                username, text, _ = self.documents[doc - self.first]
+                results.append((username, text))
+                if len(results) == size:
+                    break
+
+        return results
+
+
+def contains(posting, doc):
+    pos = bisect_left(posting, doc)
+    return pos < len(posting) and posting[pos] == doc
@@ -1,7 +1,12 @@
 from .monitor import ServerMonitor
 from .user import *
 from .channel import *
+from .fanout import Fanout
+from .history import HISTORY_MESSAGES, HISTORY_BYTES
+from .search import SEARCH_MESSAGES, SEARCH_BYTES
+from .history_store import PAGE_SIZE
 from tinychat.gui.colors import set_color
+from tinychat.network import DisconnectPolicy, SummarizePolicy, EventDispatcher, DEFLATE, json_codec, choose_codec, decode_packet
 
 from threading import Thread
 import json
@@ -10,23 +15,36 @@ import os
 
 cmd_pat = r"^/.+ ?(.+)*$"
 
+slow_consumer_timeout = 30  # seconds over the write budget before a client is kicked
+
 
 class Server:
-    def __init__(self, socket, queue):
+    def __init__(self, socket, queue, bus=None, store=None, user_store=None):
         self.socket = socket
         self.queue = queue
+        self.bus = bus  # ShardBus or ClusterBus when running as a part of a bigger server
+        self.store = store  # HistoryStore keeping the messages of the channels owned here
 
         self.ui = None
 
         self.visible = True
         self.server_name = "Server1"
         self.server_desc = "A server for testing"
+        self.compression = True  # accept deflate for clients that ask for it
+        self.history_messages = HISTORY_MESSAGES  # kept by every channel for the users that join later
+        self.history_bytes = HISTORY_BYTES
+        self.search_messages = SEARCH_MESSAGES  # indexed by every channel for /search
+        self.search_bytes = SEARCH_BYTES
 
         self.monitor = ServerMonitor(self)
 
         self.proc_thread = None
 
-        self.userlist = UserList()
+        self.codecs = dict()  # socket -> codec negotiated at login
+        self.fanout = Fanout(self)  # broadcasts to large channels are sent by a thread pool
+        self.remote_users = dict()  # username -> shard, for users connected to other workers or nodes
+
+        self.userlist = UserList(user_store, bus)  # bans and mutes survive restarts with a UserStore
         self.uconnections = ConnectionList(self.userlist)
 
         self.channels = ChannelList(self)
@@ -38,6 +56,20 @@ class Server:
 
         self.dms = DirectMessages()
 
+        self.dispatcher = EventDispatcher(self.queue, {
+            "server_start": self.started,
+            "connection_request": self.conn_request,
+            "packet": self.handle_network,
+            "disconnected": self.disconnected,
+            "server_stop": self.stopped,
+            "bus": self.handle_bus
+        }, before=self.socket.cork, after=self.socket.uncork)  # a batch of events is flushed at once
+
+        if self.bus:
+            self.bus.post = self.socket.post
+
+        self.socket.set_policy(DisconnectPolicy(slow_consumer_timeout, SummarizePolicy(self.skipped_summary)))
+
         self.load_settings()
 
     settings_path = os.path.abspath(os.path.join(os.pardir, "settings.json"))
@@ -53,6 +85,14 @@ class Server:
                     self.server_name = server_settings['server_name']
                     self.server_desc = server_settings['server_desc']
 
+                    self.history_messages = server_settings.get('history_messages', self.history_messages)
+                    self.history_bytes = server_settings.get('history_bytes', self.history_bytes)
+                    self.global_channel.history.resize(self.history_messages, self.history_bytes)
+
+                    self.search_messages = server_settings.get('search_messages', self.search_messages)
+                    self.search_bytes = server_settings.get('search_bytes', self.search_bytes)
+                    self.global_channel.search.resize(self.search_messages, self.search_bytes)
+
             except (FileExistsError, json.JSONDecodeError, KeyError):
                 pass
 
@@ -73,54 +113,71 @@ class Server:
             server_settings['visible'] = self.visible
             server_settings['server_name'] = self.server_name
             server_settings['server_desc'] = self.server_desc
+            server_settings['history_messages'] = self.history_messages
+            server_settings['history_bytes'] = self.history_bytes
+            server_settings['search_messages'] = self.search_messages
+            server_settings['search_bytes'] = self.search_bytes
             settings['server'] = server_settings
 
             f.write(json.dumps(settings))
 
     def start(self):
+        if self.userlist.store:  # users are read when they are first looked up, not here
+            self.userlist.store.open()
+
+        if self.store:  # only the global channel keeps its messages over a restart
+            channel = self.global_channel
+            channel.search.load(self.store.last(channel.name, channel.search.count))
+
         self.proc_thread = Thread(target=self.event_proc)
         self.proc_thread.start()
 
-        self.monitor.start()
-        self.monitor.broadcast()
+        if self.store:
+            self.store.open()
+
+        if self.bus:
+            self.bus.open()
+
+        if not self.bus or self.bus.primary:  # one lan announcement per server
+            self.monitor.start()
+            self.monitor.broadcast()
 
     def event_proc(self):
-        for event in iter(self.queue.get, 'exit'):
-            event_type = event[0]
-            if event_type == "server_start":
-                self.started(event[1])
-            elif event_type == "connection_request":
-                self.conn_request(event[1], event[2])
-            elif event_type == "packet":
-                self.handle_network(event[1], event[2], event[3])
-            elif event_type == "udp_packet":
-                pass  # We dont handle udp
-            elif event_type == "disconnected":
-                self.disconnected(event[1])
-            elif event_type == "server_stop":
-                self.stopped()
+        self.dispatcher.run()
+
+    def dispatch(self, event):  # called inline by AsyncServerSocket
+        self.dispatcher.dispatch(event)
 
     # rpc
 
     def rpc_send_by_addr(self, addr, data):
         uconn = self.uconnections.find_by_addr(addr, True)
         if uconn:
-            self.socket.send(uconn.socket, data.encode('utf8'))
+            self.fanout.send(uconn.socket, data.encode('utf8'))
 
     def rpc_send_by_uname(self, uname, data):
         uconn = self.uconnections.find_by_uname(uname)
         if uconn:
-            self.socket.send(uconn.socket, data.encode('utf8'))
+            self.fanout.send(uconn.socket, data.encode('utf8'))
+        elif uname in self.remote_users:
+            self.bus.send(self.remote_users[uname], {'type': 'send', 'username': uname, 'text': data})
+
+    def rpc_send_packet_by_uname(self, uname, packet):  # encoded with the codec of the user's connection
+        uconn = self.uconnections.find_by_uname(uname)
+        if uconn:
+            self.send_packet(uconn.socket, packet)
+        elif uname in self.remote_users:
+            self.bus.send(self.remote_users[uname], {'type': 'packet', 'username': uname, 'packet': packet})
 
     def rpc_broadcast_packet(self, data, bc_all=False):
         data = data.encode('utf8')
 
         for usock, _, _ in self.uconnections:
-            self.socket.send(usock, data)
+            self.fanout.send(usock, data)
 
         if bc_all:
             for usock, _, _ in self.uconnections.temp_connections():
-                self.socket.send(usock, data)
+                self.fanout.send(usock, data)
 
     def rpc_kick_by_addr(self, addr):
         uconn = self.uconnections.find_by_addr(addr, True)
@@ -128,38 +185,83 @@ class Server:
             self.socket.kick(uconn.socket)
 
     def rpc_kick_by_uname(self, uname):
+        self.kick_by_uname(uname)
+
+    def kick_by_uname(self, uname):  # also kicks users of other workers
         uconn = self.uconnections.find_by_uname(uname)
         if uconn:
             self.socket.kick(uconn.socket)
+            return True
+
+        if uname in self.remote_users:
+            self.bus.send(self.remote_users[uname], {'type': 'kick', 'username': uname})
+            return True
+
+        return False
+
+    def encode(self, socket, packet, cache=None):  # cache keeps one encoding per codec for broadcasts
+        codec = self.codecs.get(socket, json_codec)
+
+        if cache is None:
+            return codec.encode(packet)
+
+        db = cache.get(codec.name)
+        if db is None:
+            db = cache[codec.name] = codec.encode(packet)
+        return db
 
     def send_packet(self, socket, packet):
-        db = json.dumps(packet).encode('utf8')
-        self.socket.send(socket, db)
+        db = self.encode(socket, packet)
+        self.fanout.send(socket, db)
 
     def broadcast_packet(self, packet, ignored=None):
-        db = json.dumps(packet).encode('utf8')
+        self.fanout.broadcast([usock for usock, uaddr, _ in self.uconnections if uaddr != ignored], packet)
 
-        for usock, uaddr, _ in self.uconnections:
-            if uaddr != ignored:
-                self.socket.send(usock, db)
+    def send_batch(self, socket, packets):  # several packets in one frame
+        self.send_packet(socket, {'type': 'batch', 'packets': packets})
+
+    def send_history(self, socket, history):  # one batch of the stored encodings
+        codec = self.codecs.get(socket, json_codec)
+        self.fanout.send(socket, codec.encode_batch(history.encoded(codec.name)))
 
     def send_servermsg(self, socket, msg):
         packet = {
             'type': 'server_message',
             'text': msg
         }
-        db = json.dumps(packet).encode('utf8')
-        self.socket.send(socket, db)
+        self.send_packet(socket, packet)
 
     def broadcast_servermsg(self, msg):
         packet = {
             'type': 'server_message',
             'text': msg
         }
-        db = json.dumps(packet).encode('utf8')
+        self.fanout.broadcast([usock for usock, _, _ in self.uconnections], packet)
 
-        for usock, _, _ in self.uconnections:
-            self.socket.send(usock, db)
+    def skipped_summary(self, socket, count):
+        packet = {
+            'type': 'server_message',
+            'text': f"+orangered({count} messages skipped)",
+            'channel': None
+        }
+        return self.encode(socket, packet)
+
+    def get_stats(self):
+        stats = self.socket.stats()
+        dispatch_stats = self.dispatcher.stats.get()
+        fanout_stats = self.fanout.stats.get()
+
+        lines = (["+green(Network stats:)"] + [f"{name}: {value}" for name, value in stats.items()] +
+                 ["+green(Event stats:)"] + [f"{name}: {value}" for name, value in dispatch_stats.items()] +
+                 ["+green(Fan-out stats:)"] + [f"{name}: {value}" for name, value in fanout_stats.items()])
+
+        if hasattr(self.bus, 'stats'):
+            lines += ["+green(Bus stats:)"] + [f"{name}: {value}" for name, value in self.bus.stats.get().items()]
+
+        if hasattr(self.ui, 'stats'):
+            lines += ["+green(Render stats:)"] + [f"{name}: {value}" for name, value in self.ui.stats.get().items()]
+
+        return '\n'.join(lines)
 
     def started(self, err=None):
         if not err:
@@ -196,9 +298,9 @@ class Server:
                 return
             user = uconn.user
 
-            if utag_muted in user.tags:
+            if not user.check_right("sendMessagesAllowed", 1):
                 msg = "+orangered(You are muted!)"
-                reason = user.utaginfo['muted']
+                reason = user.utaginfo.get('muted')
                 if reason:
                     msg += f"\n+orangered(Reason: {reason})"
 
@@ -243,7 +345,7 @@ class Server:
                 return
 
             user = self.userlist.find_by_name(username_p)
-            if user and user.addr != addr[0]:
+            if user and user.addr != addr[0] or username_p in self.remote_users:
                 login_p = {
                     'type': 'authresp',
                     'success': False,
@@ -254,11 +356,13 @@ class Server:
 
             rename = False
             old_name = ""
+            old_name_p = ""
 
             uconn = self.uconnections.find_by_addr(addr)
             if uconn:
                 rename = True
                 old_name = uconn.user.username
+                old_name_p = uconn.user.username_p
 
                 if old_name == username:
                     return
@@ -274,13 +378,26 @@ class Server:
             if not uconn:
                 uconn = self.uconnections.create_connection(socket, addr)
 
+            codec = choose_codec(packet.get('codecs', ()))
+            compression = self.compression and DEFLATE in packet.get('compression', ())
+
             login_p = {
                 'type': 'authresp',
                 'success': True,
-                'username': username
+                'username': username,
+                'codec': codec.name,
+                'compression': DEFLATE if compression else None
             }
             self.send_packet(socket, login_p)
 
+            self.codecs[socket] = codec
+            self.socket.set_compression(socket, compression)
+
+            if self.bus:
+                if rename:
+                    self.bus.publish({'type': 'user_left', 'username': old_name_p})
+                self.bus.publish({'type': 'user', 'username': username_p})
+
             if rename:
                 self.channels.user_rename(user, old_name)
             else:
@@ -292,20 +409,96 @@ class Server:
         pass
 
     def handle_network(self, socket, addr, pdata):
-        packet = json.loads(pdata.decode('utf8'))
-
         try:
+            packet = decode_packet(pdata)
+
             if packet['type'] == 'message':
                 self.handle_message(socket, addr, packet)
             elif packet['type'] == 'direct_message':
                 self.direct_message(socket, addr, packet)
             elif packet['type'] == 'login':
                 self.handle_auth(socket, addr, packet)
+            elif packet['type'] == 'history':
+                self.handle_history(socket, addr, packet)
 
-        except (json.JSONDecodeError, KeyError):
+        except (ValueError, KeyError):
+            pass
+
+    def handle_history(self, socket, addr, packet):
+        uconn = self.uconnections.find_by_addr(addr)
+        channel = self.channels.find_channel(packet['channel'])
+
+        if not uconn or not channel or not channel.find_user(uconn.user):
+            return
+
+        if channel.shard is not None:  # stored by the worker or node that owns the channel
+            request = {key: packet.get(key) for key in ('channel', 'before', 'after', 'limit')}
+            self.bus.send(channel.shard, dict(request, type='history', username=uconn.user.username_p))
+        elif self.store:
+            self.send_packet(socket, self.history_page(packet))
+
+    def history_page(self, request):  # messages before or after a message number, the latest ones without both
+        before, after, limit = (request.get(key) if type(request.get(key)) is int else None
+                                for key in ('before', 'after', 'limit'))
+
+        first, messages = self.store.page(request['channel'], before, after, max(1, limit or PAGE_SIZE))
+
+        return {'type': 'history', 'channel': request['channel'], 'first': first, 'messages': messages}
+
+    def handle_bus(self, message):
+        try:
+            mtype = message['type']
+            shard = message['shard']
+
+            if mtype == 'broadcast':
+                channel = self.channels.find_channel(message['channel'], False)
+                if channel:
+                    channel.broadcast_packet(message['packet'], relay=False)
+            elif mtype == 'user':
+                self.remote_users[message['username']] = shard
+            elif mtype == 'user_left':
+                if self.remote_users.get(message['username']) == shard:
+                    del self.remote_users[message['username']]
+            elif mtype == 'channel':
+                self.channels.remote_channel(message['channel'], message['admin'], shard)
+            elif mtype == 'channel_remove':
+                self.channels.remote_channel_removed(message['channel'])
+            elif mtype == 'user_changed':
+                self.userlist.apply(message['addr'], message['username'], message['username_p'],
+                                    message['tags'], message['utaginfo'])
+            elif mtype == 'clearlog':
+                channel = self.channels.find_channel(message['channel'], False)
+                if channel:
+                    channel.clear_log(relay=False)
+            elif mtype == 'kick':
+                self.kick_by_uname(message['username'])
+            elif mtype == 'send':
+                self.rpc_send_by_uname(message['username'], message['text'])
+            elif mtype == 'packet':
+                self.rpc_send_packet_by_uname(message['username'], message['packet'])
+            elif mtype == 'history' and self.store:
+                self.rpc_send_packet_by_uname(message['username'], self.history_page(message))
+            elif mtype == 'node_down':
+                for username, ushard in list(self.remote_users.items()):
+                    if ushard == shard:
+                        del self.remote_users[username]
+                for name, (_, cshard) in list(self.channels.remote.items()):
+                    if cshard == shard:
+                        self.channels.remote_channel_removed(name)
+            elif mtype == 'hello':
+                for _, _, user in self.uconnections:
+                    self.bus.send(shard, {'type': 'user', 'username': user.username_p})
+                for channel in self.channels.channels.values():
+                    self.channels.publish_channel(channel, shard)
+
+        except KeyError:
             pass
 
     def disconnected(self, addr):
+        uconn = self.uconnections.find_by_addr(addr, True)
+        if uconn:
+            self.codecs.pop(uconn.socket, None)
+
         self.uconnections.destroy_temp_connection(addr)
         uconn = self.uconnections.find_by_addr(addr)
 
@@ -316,6 +509,9 @@ class Server:
 
             self.channels.user_disconnected(user)
 
+            if self.bus:
+                self.bus.publish({'type': 'user_left', 'username': user.username_p})
+
     def userinput(self, text):
         if re.match(cmd_pat, text):
             self.connected_channel.command("Server", text)
@@ -330,9 +526,19 @@ class Server:
             self.proc_thread.join()
             self.proc_thread = None
 
+        self.fanout.close()
         self.socket.close()
         self.monitor.close()
 
+        if self.store:
+            self.store.close()
+
+        if self.userlist.store:
+            self.userlist.store.close()
+
+        if self.bus:
+            self.bus.close()
+
     def exit(self):
         self.stop()
         self.save_settings()
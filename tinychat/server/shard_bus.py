@@ -0,0 +1,147 @@
+from tinychat.network import CodecError, binary_codec
+from socket import *
+from threading import Thread, Lock
+
+BUS_DATAGRAM_SIZE = 64 * 1024
+BUS_MESSAGE_SIZE = 16 * 1024 * 1024  # larger messages are split into datagrams, up to this size
+
+# first byte of a datagram
+WHOLE = b'\0'
+FRAGMENT = b'\1'  # more fragments of the message follow
+LAST_FRAGMENT = b'\2'
+
+
+def shard_address(port, shard):
+    return f"\0tinychat-{port}-{shard}"  # abstract unix socket, nothing to clean up on exit
+
+
+class BusStats:
+    def __init__(self):
+        self.sent = 0
+        self.fragmented = 0
+        self.dropped = 0  # too large to send, or fragments of a message that never completed
+
+    def get(self):
+        return {
+            'bus_messages_sent': self.sent,
+            'bus_messages_fragmented': self.fragmented,
+            'bus_messages_dropped': self.dropped
+        }
+
+
+class ShardBus:
+    # datagrams between the worker processes of one server, see server_main.py --workers
+    def __init__(self, port, shard, shards, exception_handler):
+        self.port = port
+        self.shard = shard
+        self.shards = shards
+        self.primary = shard == 0  # announces the server in the lan
+
+        self.post = None  # gets ("bus", message) events, set by the Server
+        self.exception = exception_handler
+        self.stats = BusStats()
+
+        self._socket = None
+        self._send_lock = Lock()  # keeps the fragments of a message together
+        self._partial = dict()  # sender address -> fragments received so far
+        self._running = False
+        self._thread = None
+
+    def open(self):
+        self._socket = socket(AF_UNIX, SOCK_DGRAM)
+        self._socket.bind(shard_address(self.port, self.shard))
+
+        self._running = True
+        self._thread = Thread(target=self._threadmain)
+        self._thread.start()
+
+        self.publish({'type': 'hello'})  # running shards answer with their users and channels
+
+    def _threadmain(self):
+        while self._running:
+            try:
+                data, sender = self._socket.recvfrom(BUS_DATAGRAM_SIZE)
+            except error as e:
+                self.exception(e)
+                break
+
+            if not data:
+                continue  # close() wakes the thread with an empty datagram
+
+            data = self._reassemble(data, sender)
+            if data is None:
+                continue
+
+            try:
+                self.post(("bus", binary_codec.decode(data)))
+            except CodecError as e:
+                self.exception(e)
+
+    def _reassemble(self, data, sender):  # -> the whole message, None while fragments are missing
+        kind = data[:1]
+        fragments = self._partial.pop(sender, None)
+
+        if kind == WHOLE:
+            if fragments:  # the sender restarted in the middle of a message
+                self.stats.dropped += 1
+            return data[1:]
+
+        fragments = fragments or list()
+        fragments.append(data[1:])
+
+        if kind == LAST_FRAGMENT:
+            return b''.join(fragments)
+
+        self._partial[sender] = fragments
+        return None
+
+    def send(self, shard, message):
+        message = dict(message, shard=self.shard)
+
+        try:
+            data = binary_codec.encode(message)
+        except CodecError as e:
+            self.exception(e)
+            return
+
+        if len(data) > BUS_MESSAGE_SIZE:
+            self.stats.dropped += 1
+            self.exception(f"bus message len > {BUS_MESSAGE_SIZE}")
+            return
+
+        address = shard_address(self.port, shard)
+        chunk = BUS_DATAGRAM_SIZE - 1
+
+        try:
+            with self._send_lock:
+                if len(data) <= chunk:
+                    self._socket.sendto(WHOLE + data, address)
+                else:
+                    self.stats.fragmented += 1
+
+                    for pos in range(0, len(data), chunk):
+                        kind = FRAGMENT if pos + chunk < len(data) else LAST_FRAGMENT
+                        self._socket.sendto(kind + data[pos:pos + chunk], address)
+
+                self.stats.sent += 1
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass  # shard is not running
+        except error as e:
+            self.exception(e)
+
+    def publish(self, message):
+        for shard in range(self.shards):
+            if shard != self.shard:
+                self.send(shard, message)
+
+    def close(self):
+        if not self._running:
+            return
+
+        self._running = False
+        self._socket.sendto(b'', shard_address(self.port, self.shard))
+
+        self._thread.join()
+        self._thread = None
+
+        self._socket.close()
@@ -1,9 +1,11 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from tinychat.gui.colors import parse2
 import string
 
 uconn_t = namedtuple("uconnection", ("socket", "addr", "user"))
 
+MISS_CACHE = 4096  # store lookups that found nothing, remembered so they are not repeated
+
 
 class UserTag:
     def __init__(self, name, level, rights):
@@ -18,6 +20,8 @@ utag_muted = UserTag("muted", 2, {"sendMessagesAllowed": 0})
 utag_admin = UserTag("admin", 3, {"adminCommandsAccess": 1})
 utag_banned = UserTag("banned", 5, {"serverAccess": 0})
 
+user_tags = {tag.name: tag for tag in (utag_default, utag_muted, utag_admin, utag_banned)}  # by the stored names
+
 
 class User:
     def __init__(self, addr):
@@ -25,14 +29,22 @@ class User:
         self.tags = [utag_default]
         self.utaginfo = dict()
         self.rights = set()
+        self._effective = None  # right -> value of the highest tag that has it, reset on tag changes
 
         self.username = ""
         self.username_p = ""
 
+        self.userlist = None  # keeps its name index up to date on rename, and the store
+
     def set_username(self, uname, uname_p):
+        old_p = self.username_p
+
         self.username = uname
         self.username_p = uname_p
 
+        if self.userlist:
+            self.userlist.renamed(self, old_p)
+
     @staticmethod
     def filter_username(username):
         ru_letters = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
@@ -48,50 +60,163 @@ class User:
     def add_tag(self, tag):
         if tag not in self.tags:
             self.tags.append(tag)
+            self._effective = None
+            self.changed()
 
     def remove_tag(self, tag):
         if tag in self.tags:
             self.tags.remove(tag)
+            self._effective = None
+            self.changed()
+
+    def changed(self):  # also to be called after utaginfo is changed without a tag change
+        if self.userlist:
+            self.userlist.changed(self)
+
+    def effective_rights(self):
+        if self._effective is None:
+            effective = dict()
+
+            for tag in sorted(self.tags, key=lambda t: t.level, reverse=True):  # the first tag wins a tie
+                if tag.level > 0:
+                    for right, value in tag.rights.items():
+                        effective.setdefault(right, value)
+
+            self._effective = effective
+        return self._effective
 
     def check_right(self, right, value):
-        check_result = False
-        check_level = 0
+        effective = self._effective
+        if effective is None:
+            effective = self.effective_rights()
 
-        for tag in self.tags:
-            if tag.level > check_level and right in tag.rights:
-                check_result = value == tag.rights[right]
-                check_level = tag.level
-        return check_result
+        return right in effective and effective[right] == value
 
 
 class UserList:
-    def __init__(self):
-        self.users = list()
+    def __init__(self, store=None, bus=None):
+        self.store = store  # UserStore, users missing here are looked up in it
+        self.bus = bus  # other workers and nodes keep users of their own, they get every change
+        self.users = dict()  # user -> None, ordered set
+
+        self._by_addr = dict()  # ip -> user
+        self._by_name = dict()  # username_p -> user
+        self._missing = OrderedDict()  # (field, value) -> None, least recently looked up first
 
     def add_user(self, user):
-        self.users.append(user)
+        if user in self.users:
+            return
+
+        self._add(user)
+        self.changed(user)
+
+    def _add(self, user):
+        self.users[user] = None
+        user.userlist = self
+
+        self._by_addr.setdefault(user.addr, user)
+        self._by_name.setdefault(user.username_p, user)
+
+        self._missing.pop(('addr', user.addr), None)
+        self._missing.pop(('username_p', user.username_p), None)
 
     def remove_user(self, user):
-        if user in self.users:
-            self.users.remove(user)
+        if user not in self.users:
+            return
+
+        del self.users[user]
+        user.userlist = None
+
+        if self._by_addr.get(user.addr) is user:
+            del self._by_addr[user.addr]
+        if self._by_name.get(user.username_p) is user:
+            del self._by_name[user.username_p]
+
+    def renamed(self, user, old_name):
+        self._reindex(user, old_name)
+        self.changed(user)
+
+    def _reindex(self, user, old_name):
+        if self._by_name.get(old_name) is user:
+            del self._by_name[old_name]
+
+        self._by_name.setdefault(user.username_p, user)
+        self._missing.pop(('username_p', user.username_p), None)
+
+    def changed(self, user):
+        if self.store:
+            self.store.save(user)
+
+        if self.bus:
+            self.bus.publish({'type': 'user_changed', 'addr': user.addr, 'username': user.username,
+                              'username_p': user.username_p, 'tags': [tag.name for tag in user.tags],
+                              'utaginfo': user.utaginfo})
+
+    def apply(self, addr, username, username_p, tags, utaginfo):  # a change made elsewhere, already stored
+        user = self._by_addr.get(addr)
+
+        if user is None:  # kept here too, the store may not have it yet
+            user = User((addr,))
+            user.username = username
+            user.username_p = username_p
+            self._add(user)
+        elif user.username_p != username_p:
+            old_p = user.username_p
+            user.username = username
+            user.username_p = username_p
+            self._reindex(user, old_p)
+
+        user.tags = [user_tags[name] for name in tags if name in user_tags]
+        user.utaginfo = utaginfo
+        user._effective = None
+
+    def _load(self, field, value):
+        key = (field, value)
+
+        if key in self._missing:
+            self._missing.move_to_end(key)
+            return None
+
+        user = self.store.load(field, value)
+
+        if user:
+            self._add(user)
+        else:
+            self._missing[key] = None
+            if len(self._missing) > MISS_CACHE:
+                self._missing.popitem(last=False)
+        return user
 
     def find_by_addr(self, addr):
-        for user in self.users:
-            if user.addr == addr[0]:
-                return user
+        user = self._by_addr.get(addr[0])
+
+        if user is None and self.store:
+            user = self._load('addr', addr[0])
+        return user
 
     def find_by_name(self, username):
-        for user in self.users:
-            if user.username_p == username:
-                return user
+        user = self._by_name.get(username)
+
+        if user is None and self.store and username:
+            user = self._load('username_p', username)
+        return user
+
+    def __iter__(self):
+        yield from self.users
+
+    def __len__(self):
+        return len(self.users)
 
 
 class ConnectionList:
     def __init__(self, userlist):
         self._ulist = userlist
-        self.connections = list()
 
-        self.temp_connections = list()
+        self.connections = dict()  # addr -> uconn, in connection order
+        self._temp = dict()  # addr -> uconn without a user, until login
+
+        self._by_socket = dict()  # socket -> uconn, temporary or not
+        self._by_user = dict()  # user -> [uconn]
 
     def create_connection(self, socket, addr):
         user = self._ulist.find_by_addr(addr)
@@ -100,39 +225,59 @@ class ConnectionList:
         if not user:
             return None
 
+        self.destroy_temp_connection(addr)  # promoted
+
         conn = uconn_t(socket, addr, user)
-        self.connections.append(conn)
+        self.connections[addr] = conn
+        self._by_socket[socket] = conn
+        self._by_user.setdefault(user, list()).append(conn)
         return conn
 
     def destroy_connection(self, addr):
-        conn = self.find_by_addr(addr)
-        if conn:
-            self.connections.remove(conn)
+        conn = self.connections.pop(addr, None)
+        if not conn:
+            return
+
+        if self._by_socket.get(conn.socket) is conn:
+            del self._by_socket[conn.socket]
+
+        conns = self._by_user[conn.user]
+        conns.remove(conn)
+        if not conns:
+            del self._by_user[conn.user]
 
     def create_temp_connection(self, socket, addr):
         conn = uconn_t(socket, addr, None)
-        self.temp_connections.append(conn)
+        self._temp[addr] = conn
+        self._by_socket[socket] = conn
 
     def destroy_temp_connection(self, addr):
-        for conn in self.temp_connections:
-            if conn.addr == addr:
-                self.temp_connections.remove(conn)
-                break
+        conn = self._temp.pop(addr, None)
+
+        if conn and self._by_socket.get(conn.socket) is conn:
+            del self._by_socket[conn.socket]
+
+    def temp_connections(self):
+        return list(self._temp.values())
 
     def find_by_addr(self, addr, temp=False):
-        for conn in self.connections:
-            if conn.addr == addr:
-                return conn
+        conn = self.connections.get(addr)
 
-        if temp:
-            for conn in self.temp_connections:
-                if conn.addr == addr:
-                    return conn
+        if not conn and temp:
+            conn = self._temp.get(addr)
+
+        return conn
+
+    def find_by_socket(self, socket):
+        return self._by_socket.get(socket)
 
     def find_by_uname(self, username):
-        for conn in self.connections:
-            if conn.user.username_p == username:
-                return conn
+        conns = self._by_user.get(self._ulist.find_by_name(username))
+        if conns:
+            return conns[0]
 
     def __iter__(self):
-        yield from self.connections
+        yield from list(self.connections.values())
+
+    def __len__(self):
+        return len(self.connections)
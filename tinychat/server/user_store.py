@@ -0,0 +1,115 @@
+from .user import User, user_tags
+from queue import Queue, Empty
+from threading import Thread, Lock
+import json
+import sqlite3
+import time
+
+COMMIT_INTERVAL = 1  # seconds, changes are written in one transaction at most this often
+
+schema = """
+CREATE TABLE IF NOT EXISTS users (
+    addr TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    username_p TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    utaginfo TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username_p ON users (username_p);
+"""
+
+
+class UserStore:
+    # users with their tags and tag reasons (bans, mutes) in sqlite. Users are read one by one when
+    # the UserList misses them, changes are queued and written by a thread of its own
+    def __init__(self, path, exception_handler, commit_interval=COMMIT_INTERVAL):
+        self.path = path
+        self.exception = exception_handler
+        self.commit_interval = commit_interval
+
+        self._db = None  # for the lookups, the writer has a connection of its own
+        self._db_lock = Lock()
+
+        self._queue = Queue()
+        self._thread = None
+
+    def open(self):
+        self._db = self._connect()
+        self._db.executescript(schema)
+        self._db.commit()
+
+        self._thread = Thread(target=self._writer_main)
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")  # lookups are not blocked by the writer
+        return db
+
+    def load(self, field, value):  # field is 'addr' or 'username_p'
+        with self._db_lock:
+            try:
+                row = self._db.execute(f"SELECT * FROM users WHERE {field} = ?", (value,)).fetchone()
+            except sqlite3.Error as e:
+                self.exception(e)
+                return None
+
+        if not row:
+            return None
+
+        addr, username, username_p, tags, utaginfo = row
+
+        user = User((addr,))
+        user.set_username(username, username_p)
+        user.tags = [user_tags[name] for name in tags.split(',') if name in user_tags]
+        user.utaginfo = json.loads(utaginfo)
+        return user
+
+    def save(self, user):  # a snapshot, the user may change again before it is written
+        tags = ','.join(tag.name for tag in user.tags)
+        self._queue.put((user.addr, user.username, user.username_p, tags, json.dumps(user.utaginfo)))
+
+    def _writer_main(self):
+        db = self._connect()
+        pending = dict()  # addr -> row, the last change of every user
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+
+            try:
+                row = self._queue.get(timeout=timeout)
+            except Empty:
+                row = False
+
+            if row:
+                pending[row[0]] = row
+                if deadline is None:
+                    deadline = time.monotonic() + self.commit_interval
+                if time.monotonic() < deadline:
+                    continue
+
+            if pending:
+                try:
+                    with db:
+                        db.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)", pending.values())
+                except sqlite3.Error as e:
+                    self.exception(e)
+
+                pending.clear()
+            deadline = None
+
+            if row is None:
+                break
+
+        db.close()
+
+    def close(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        if self._db:
+            self._db.close()
+            self._db = None